@@ -0,0 +1,362 @@
+"""
+    Timing-accuracy benchmark for song playback, LED flashing and the shutdown button
+    Runs the fishdish effects against an instrumented simulated GPIO that timestamps every output and PWM
+    transition, and reports jitter percentiles, cumulative drift and button-to-callback latency as JSON
+    so that results can be compared across commits and under synthetic CPU load.
+
+    usage: python benchmark.py [--load N] [--presses N] [--shutdown] [--parser] [--timers] [--output FILE]
+"""
+
+import os
+import json
+import time
+import logging
+import platform
+import argparse
+import threading
+import subprocess
+import multiprocessing
+import clock
+import simGPIO
+
+
+class InstrumentedGPIO(simGPIO.GPIO):
+    """Simulated GPIO that records (time, event, channel, value) for every output and PWM call"""
+
+    class PWMChannel(simGPIO.GPIO.PWMChannel):
+
+        def ChangeFrequency(self, frequency):
+            self.gpio.record('frequency', self.channel, frequency)
+            simGPIO.GPIO.PWMChannel.ChangeFrequency(self, frequency)
+
+        def ChangeDutyCycle(self, dutycycle):
+            self.gpio.record('dutycycle', self.channel, dutycycle)
+            simGPIO.GPIO.PWMChannel.ChangeDutyCycle(self, dutycycle)
+
+    def __init__(self):
+        simGPIO.GPIO.__init__(self)
+        self.transitions = []
+
+    def record(self, event, channel, value):
+        self.transitions.append((clock.monotonic(), event, channel, value))
+
+    def output(self, channel, state):
+        self.record('output', channel, state)
+        simGPIO.GPIO.output(self, channel, state)
+
+    def select(self, event, channel):
+        """Returns the times and values of the recorded transitions of one kind on one channel"""
+        return [(t, v) for t, e, c, v in self.transitions if e == event and c == channel]
+
+
+def percentiles(values, points=(50, 90, 99, 100)):
+    """Nearest-rank percentiles of values, in milliseconds"""
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        if not ordered:
+            result['p' + str(point)] = None
+            continue
+        rank = max(0, int(round(point / 100.0 * len(ordered))) - 1)
+        result['p' + str(point)] = round(ordered[rank] * 1000, 3)
+    return result
+
+
+def schedule_errors(actual, expected):
+    """Errors of actual event times against expected offsets, taking the first event as the origin"""
+    origin = actual[0] - expected[0]
+    return [a - origin - e for a, e in zip(actual, expected)]
+
+
+def summary(errors):
+    return {
+        'events': len(errors),
+        'jitter_ms': percentiles([abs(e) for e in errors]),
+        'drift_ms': round(errors[-1] * 1000, 3) if errors else None,
+    }
+
+
+def bench_song(fishdish, gpio, song):
+    """Plays a song on the simulated piezo and compares note starts with the ideal schedule"""
+    del gpio.transitions[:]
+    worst, drift = song.playsong()
+    starts = [t for t, v in gpio.select('dutycycle', fishdish.BUZZER) if v > 0]
+    tempo = 108.0 / float(song.tempo)
+    expected = []
+    offset = 0.0
+    for pitch, divisor in zip(song.frequencies, song.durations):
+        duration = tempo / float(divisor)
+        if pitch > 0:
+            expected.append(offset)
+        offset += duration * 1.3
+    result = summary(schedule_errors(starts, expected))
+    result['title'] = song.title
+    result['self_reported'] = {'worst_ms': round(worst * 1000, 3), 'drift_ms': round(drift * 1000, 3)}
+    return result
+
+
+def bench_flash(fishdish, gpio, frequency=0.1, cycles=20):
+    """Flashes the green LED and compares its transitions with the ideal half-period schedule"""
+    del gpio.transitions[:]
+    fishdish.flashled(fishdish.LED_GRN, frequency, cycles)
+    edges = [t for t, v in gpio.select('output', fishdish.LED_GRN)]
+    return summary(schedule_errors(edges, [i * frequency / 2.0 for i in range(len(edges))]))
+
+
+def bench_button(fishdish, gpio, presses=200):
+    """Measures the latency from a simulated button edge to the start of its callback"""
+    latencies = []
+    called = threading.Event()
+    pressed = [0.0]
+
+    def callback(channel):
+        latencies.append(clock.monotonic() - pressed[0])
+        called.set()
+
+    gpio.setup(fishdish.BUTTON, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+    gpio.add_event_detect(fishdish.BUTTON, gpio.RISING, callback=callback)
+    for _ in range(presses):
+        called.clear()
+        pressed[0] = clock.monotonic()
+        gpio.set_input(fishdish.BUTTON, gpio.HIGH)
+        called.wait(1.0)
+        gpio.set_input(fishdish.BUTTON, gpio.LOW)
+    gpio.cleanup()
+    return {'presses': presses, 'latency_ms': percentiles(latencies)}
+
+
+def bench_shutdown(fishdish, gpio, hold_time=3.0, sample_interval=0.001):
+    """Times how fast a short press is cancelled on release, then holds the button through the hold detection
+    and countdown and times the red LED blinks"""
+    import button
+    import eventloop
+    del gpio.transitions[:]
+    fishdish._shutting_down = False
+    fishdish._shutdown = False
+    fishdish.endSong = None
+    released = []
+    fishdish._button = button.ButtonHold(gpio, fishdish.BUTTON, eventloop.shared_loop(), hold_time, sample_interval,
+                                         on_hold=fishdish.halt_requested,
+                                         on_release=lambda channel, held: released.append(clock.monotonic()))
+    gpio.setup(fishdish.BUTTON, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+    gpio.add_event_detect(fishdish.BUTTON, gpio.BOTH, callback=fishdish.shutdown)
+    gpio.set_input(fishdish.BUTTON, gpio.HIGH)
+    time.sleep(0.2)
+    let_go = clock.monotonic()
+    gpio.set_input(fishdish.BUTTON, gpio.LOW)
+    time.sleep(0.1)
+    gpio.set_input(fishdish.BUTTON, gpio.HIGH)
+    pressed = clock.monotonic()
+    fishdish.idle_wait()
+    gpio.set_input(fishdish.BUTTON, gpio.LOW)
+    gpio.cleanup()
+    blinks = [t for t, v in gpio.select('output', fishdish.LED_RED)]
+    result = summary(schedule_errors(blinks, [i * 0.5 for i in range(len(blinks))]))
+    result['hold_error_ms'] = round((blinks[0] - pressed - hold_time) * 1000, 3) if blinks else None
+    result['release_cancel_ms'] = round((released[0] - let_go) * 1000, 3) if released else None
+    fishdish._halt.wait(1.0)
+    result['button_to_halt_ms'] = round(fishdish.BUTTON_TO_HALT.value * 1000, 3)
+    result['stages_ms'] = dict((name, round((finished - started) * 1000, 3))
+                               for name, (started, finished) in fishdish._halt.timings.items())
+    return result
+
+
+def _parse_legacy(ringtone):
+    """The character-by-character RTTL parser that preceded rttl.parse(), the baseline of bench_parser"""
+    defaults = ringtone.split(':')[1].strip()
+    melody = ringtone.split(':')[2]
+    default_duration = defaults.split(',')[0].strip().replace('d=', '')
+    default_octave = defaults.split(',')[1].strip().replace('o=', '')
+    tempo = int(defaults.split(',')[2].strip().replace('b=', ''))
+    notes = []
+    durations = []
+    for melody_note in melody.split(','):
+        melody_note = melody_note.strip()
+        pos = 0
+        note_found = False
+        is_octave = False
+        duration = ''
+        note = ''
+        octave = ''
+        while pos < len(melody_note) and not note_found:
+            try:
+                if int(melody_note[pos]) in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
+                    duration += melody_note[pos]
+            except ValueError:
+                if melody_note[pos].lower() in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'p']:
+                    note_found = True
+                    note += melody_note[pos].upper()
+            pos += 1
+        duration = int(duration or default_duration)
+        while pos < len(melody_note) and not is_octave:
+            try:
+                if int(melody_note[pos]) in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
+                    is_octave = True
+                    octave = melody_note[pos]
+            except ValueError:
+                if melody_note[pos] == '#':
+                    note += melody_note[pos]
+                elif melody_note[pos] == '.':
+                    duration = int(1.0 / (1.0 / float(duration) * 1.5))
+            pos += 1
+        if note != 'P':
+            note += octave if is_octave else default_octave
+        notes.append(note)
+        durations.append(duration)
+    return ringtone.split(':')[0].strip(), tempo, notes, durations
+
+
+def bench_parser(ringtones, repeat=3):
+    """Compares the RTTL throughput of rttl.parse with the legacy parser.
+
+    :return: dictionary of ringtones per second by parser
+    """
+    import rttl
+    results = {}
+    for name, parser in (('tokenizer', rttl.parse), ('legacy', _parse_legacy)):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            for ringtone in ringtones:
+                parser(ringtone)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = round(len(ringtones) / best) if best > 0 else float('inf')
+    results['speedup'] = round(results['tokenizer'] / results['legacy'], 2)
+    return results
+
+
+class _ThreadTimer(object):
+    """The thread-per-tick repeating timer that preceded the event loop timer service, the baseline of bench_timers"""
+
+    def __init__(self, seconds, target):
+        self.seconds = seconds
+        self.target = target
+        self.thread = None
+        self._should_continue = True
+
+    def _handle_target(self):
+        self.target()
+        self._start_timer()
+
+    def _start_timer(self):
+        if self._should_continue:
+            self.thread = threading.Timer(self.seconds, self._handle_target)
+            self.thread.start()
+
+    def cancel(self):
+        self._should_continue = False
+        if self.thread is not None:
+            self.thread.cancel()
+
+
+def bench_timers(jobs=100, interval=0.01, duration=2.0):
+    """Runs the same number of periodic jobs on the timer service and on thread-per-tick timers.
+
+    :return: dictionary by design of ticks (fraction of the expected count) and CPU time used (s)
+    """
+    import eventloop
+    results = {}
+    expected = jobs * duration / interval
+    for design in ('service', 'thread-per-tick'):
+        ticks = [0]
+        lock = threading.Lock()
+
+        def tick():
+            with lock:
+                ticks[0] += 1
+
+        cpu = sum(os.times()[:2])
+        if design == 'service':
+            loop = eventloop.EventLoop()
+            loop.start(name='bench')
+            timers = [loop.call_every(interval, tick) for _ in range(jobs)]
+        else:
+            loop = None
+            timers = [_ThreadTimer(interval, tick) for _ in range(jobs)]
+            for timer in timers:
+                timer._start_timer()
+        time.sleep(duration)
+        for timer in timers:
+            timer.cancel()
+        if loop is not None:
+            loop.stop()
+        results[design] = {
+            'ticks': round(ticks[0] / expected, 3),
+            'cpu': round(sum(os.times()[:2]) - cpu, 3),
+        }
+    return results
+
+
+def _spin():
+    while True:
+        pass
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(load=0, presses=200, shutdown=False, parser=False, timers=False):
+    """Runs the benchmarks, with load busy processes competing for the CPU, and returns the results"""
+    import fishdish
+    gpio = InstrumentedGPIO()
+    gpio.setmode(gpio.BCM)
+    gpio.setup([fishdish.LED_GRN, fishdish.LED_YEL, fishdish.LED_RED, fishdish.BUZZER], gpio.OUT)
+    fishdish.GPIO = gpio
+    fishdish.log = logging.getLogger('benchmark')
+    fishdish.log.addHandler(logging.NullHandler())
+    fishdish._debug = False
+    workers = [multiprocessing.Process(target=_spin) for _ in range(load)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        results = {
+            'revision': revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'load': load,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'song': bench_song(fishdish, gpio, fishdish.loadsong(fishdish.smdRingtone, piezo=True)),
+            'flash': bench_flash(fishdish, gpio),
+            'button': bench_button(fishdish, gpio, presses),
+        }
+        if shutdown:
+            results['shutdown'] = bench_shutdown(fishdish, gpio)
+        if parser:
+            results['parser'] = bench_parser([fishdish.smdRingtone] * 5000)
+        if timers:
+            results['timers'] = bench_timers()
+    finally:
+        for worker in workers:
+            worker.terminate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fishdish timing-accuracy benchmark')
+    parser.add_argument('--load', type=int, default=0, help='number of busy processes to run as CPU load')
+    parser.add_argument('--presses', type=int, default=200, help='button presses for the latency benchmark')
+    parser.add_argument('--shutdown', action='store_true', help='also time the shutdown hold and countdown (about 8 seconds)')
+    parser.add_argument('--parser', action='store_true', help='also compare the RTTL parser with the legacy one')
+    parser.add_argument('--timers', action='store_true',
+                        help='also compare the timer service with thread-per-tick timers (about 4 seconds)')
+    parser.add_argument('-o', '--output', help='write the JSON results to a file instead of stdout')
+    args = parser.parse_args()
+    results = run(args.load, args.presses, args.shutdown, args.parser, args.timers)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+    Non-blocking debounce and hold detection for a push button
+    GPIO edge callbacks only hand the edge to an event loop and return; the button is then sampled at a
+    configurable rate on the loop until it has been held long enough or is released.
+"""
+
+import clock
+
+
+class ButtonHold(object):
+    """Calls on_hold(channel) once a button has been held high continuously for hold_time seconds.
+
+    A release, seen either as an edge or by a sample, cancels the hold at once and calls on_release(channel, held)
+    with the time it was held. on_edge(latency), if given, is called on the loop with the seconds each edge
+    waited between its callback and being handled.
+    """
+
+    def __init__(self, GPIO, channel, loop, hold_time=3.0, sample_interval=0.01, on_hold=None, on_release=None,
+                 on_edge=None):
+        self.GPIO = GPIO
+        self.channel = channel
+        self.loop = loop
+        self.hold_time = hold_time
+        self.sample_interval = sample_interval
+        self.on_hold = on_hold
+        self.on_release = on_release
+        self.on_edge = on_edge
+        self.pressed_at = None
+        self.sampler = None
+
+    def edge(self, channel):
+        """GPIO edge callback for RISING, FALLING or BOTH; safe to call from any thread and never blocks"""
+        self.loop.call_soon_threadsafe(self._edge, clock.monotonic())
+
+    def _edge(self, received):
+        if self.on_edge is not None:
+            self.on_edge(clock.monotonic() - received)
+        if self.GPIO.input(self.channel):
+            if self.sampler is None:
+                self.pressed_at = received
+                self.sampler = self.loop.call_every(self.sample_interval, self._sample, name='button_sampler')
+        elif self.sampler is not None:
+            self._release()
+
+    def _sample(self):
+        if not self.GPIO.input(self.channel):
+            self._release()
+        elif clock.monotonic() - self.pressed_at >= self.hold_time:
+            self._stop()
+            if self.on_hold is not None:
+                self.on_hold(self.channel)
+
+    def _release(self):
+        held = clock.monotonic() - self.pressed_at
+        self._stop()
+        if self.on_release is not None:
+            self.on_release(self.channel, held)
+
+    def _stop(self):
+        self.sampler.cancel()
+        self.sampler = None
@@ -0,0 +1,183 @@
+"""
+    Serialised song playback on the buzzer
+    One Buzzer owns the buzzer and plays songs one at a time, as tasks on an event loop, from a bounded priority
+    queue. A song request either preempts the song playing, waits in the queue or is dropped when the buzzer is
+    busy, and returns a Request that completes when the song has finished or was stopped.
+"""
+
+import heapq
+import itertools
+import threading
+import clock
+
+# what to do with a request while another song is playing
+PREEMPT = 'preempt'     # stop a song of the same or lower priority, otherwise queue
+QUEUE = 'queue'
+DROP = 'drop'
+
+# request outcomes
+PLAYED = 'played'
+PREEMPTED = 'preempted'
+CANCELLED = 'cancelled'
+DROPPED = 'dropped'
+FAILED = 'failed'
+
+
+class Request(object):
+    """A song requested from a Buzzer, completed with its outcome once it has been played or stopped"""
+
+    def __init__(self, buzzer, song, priority, policy, window):
+        self.buzzer = buzzer
+        self.song = song
+        self.priority = priority
+        self.policy = policy
+        self.window = window
+        self.outcome = None
+        self.error = None
+        self.task = None
+        self.finished = threading.Event()
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the request is complete; never call it on the buzzer's loop thread.
+
+        :return: the outcome, None on timeout
+        """
+        self.finished.wait(timeout)
+        return self.outcome
+
+    def add_done_callback(self, callback):
+        """Calls callback(request) when the request completes, at once if it already has"""
+        with self._lock:
+            if not self.done:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """Removes the song from the queue or stops it playing (thread-safe)"""
+        self.buzzer.loop.call_soon_threadsafe(self.buzzer._cancel, self)
+
+    def _complete(self, outcome):
+        with self._lock:
+            self.outcome = outcome
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Buzzer(object):
+    """Plays songs one at a time on an event loop.
+
+    :param loop: eventloop.EventLoop that runs the songs
+    :param maxsize: longest queue, the lowest priority request is dropped beyond it
+    """
+
+    def __init__(self, loop, maxsize=8):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.current = None
+        self.queue = []         # heap of (-priority, sequence, request) (loop thread only)
+        self.started = {}       # last start time by song title
+        self._counter = itertools.count()
+
+    def play(self, song, priority=0, policy=QUEUE, window=0.0):
+        """Requests a song (thread-safe).
+
+        :param song: anything with a title and a playsong_co() coroutine
+        :param priority: higher priority songs are played first and may preempt lower ones
+        :param policy: PREEMPT, QUEUE or DROP, what to do when another song is playing
+        :param window: if positive, the song is dropped when it is already queued or playing or was started
+                       less than window seconds ago
+        :return: Request
+        """
+        request = Request(self, song, priority, policy, window)
+        self.loop.call_soon_threadsafe(self._submit, request)
+        return request
+
+    def stop(self):
+        """Empties the queue and stops the song playing (thread-safe)"""
+        def _stop():
+            for _, _, request in self.queue:
+                request._complete(CANCELLED)
+            self.queue = []
+            if self.current is not None:
+                self._cancel(self.current)
+        self.loop.call_soon_threadsafe(_stop)
+
+    def _duplicate(self, request):
+        title = request.song.title
+        if self.current is not None and self.current.song.title == title:
+            return True
+        if any(queued.song.title == title for _, _, queued in self.queue):
+            return True
+        started = self.started.get(title)
+        return started is not None and clock.monotonic() - started < request.window
+
+    def _submit(self, request):
+        if request.window > 0 and self._duplicate(request):
+            request._complete(DROPPED)
+            return
+        current = self.current
+        if current is None:
+            self._start(request)
+        elif request.policy == DROP:
+            request._complete(DROPPED)
+        else:
+            self._enqueue(request)
+            if request.policy == PREEMPT and request.priority >= current.priority:
+                current.outcome = PREEMPTED
+                current.task.cancel()   # the next song starts once the current one has stopped
+
+    def _enqueue(self, request):
+        # a preempting request goes ahead of queued requests of the same priority
+        sequence = -next(self._counter) if request.policy == PREEMPT else next(self._counter)
+        heapq.heappush(self.queue, (-request.priority, sequence, request))
+        if len(self.queue) > self.maxsize:
+            lowest = max(self.queue)
+            self.queue.remove(lowest)
+            heapq.heapify(self.queue)
+            lowest[2]._complete(DROPPED)
+
+    def _cancel(self, request):
+        if request is self.current:
+            request.outcome = CANCELLED
+            request.task.cancel()
+            return
+        for entry in self.queue:
+            if entry[2] is request:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                request._complete(CANCELLED)
+                return
+
+    def _start(self, request):
+        self.current = request
+        self.started[request.song.title] = clock.monotonic()
+        request.task = self.loop.spawn(self._run(request), name='song' + request.song.title)
+
+    def _run(self, request):
+        performance = request.song.playsong_co()
+        outcome = PLAYED
+        try:
+            for deadline in performance:
+                yield deadline
+        except Exception as e:
+            outcome = FAILED
+            request.error = e
+            raise
+        except GeneratorExit:
+            outcome = request.outcome or CANCELLED
+            raise
+        finally:
+            performance.close()
+            self.current = None
+            request._complete(outcome)
+            if self.queue:
+                self._start(heapq.heappop(self.queue)[2])
@@ -0,0 +1,59 @@
+"""
+    Monotonic clock for scheduling against absolute deadlines
+    Python 2 has no time.monotonic, and time.time steps when a Pi without RTC syncs NTP after boot
+"""
+
+import sys
+import time
+
+
+def _linux_monotonic():
+    import ctypes
+
+    CLOCK_MONOTONIC = 1
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL('librt.so.1', use_errno=True)
+    except OSError:
+        import ctypes.util     # slow: searches the linker cache, so only as a fallback
+        librt = ctypes.CDLL(ctypes.util.find_library('rt'), use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic():
+        ts = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    return monotonic
+
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    if sys.platform.startswith('linux'):
+        try:
+            monotonic = _linux_monotonic()
+        except (OSError, AttributeError):
+            monotonic = time.time
+    elif sys.platform.startswith('win32'):
+        monotonic = time.clock     # QueryPerformanceCounter on Windows
+    else:
+        monotonic = time.time
+
+
+def sleep_until(deadline):
+    """Sleeps until the monotonic clock reaches deadline; returns immediately if it has passed"""
+    remaining = deadline - monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def run_blocking(coroutine):
+    """Drives a generator that yields monotonic deadlines (see eventloop) on the calling thread"""
+    for deadline in coroutine:
+        sleep_until(deadline)
@@ -0,0 +1,188 @@
+"""
+    Local control socket for a running fishdish
+    Other services drive the board through a Unix domain socket instead of opening the GPIO themselves.
+    The server runs on the fishdish event loop: the listening and client sockets are watched by the loop's
+    select() (see eventloop.EventLoop.add_reader), so commands run on the thread that plays the songs and LEDs
+    and are answered without any thread hand-off.
+
+    Protocol: one command per line, words separated by spaces (quotes group words), answered with one line
+    starting with 'ok' or 'error', e.g.
+        play SuperMarioDies 1 preempt   ->  ok
+        led heartbeat yel               ->  ok
+        status                          ->  ok {"playing": "SuperMarioDies", ...}
+
+    usage: python control.py [--socket PATH] [--repeat N] command [args...]
+"""
+
+import os
+import time
+import errno
+import shlex
+import socket
+
+SOCKET_PATH = '/tmp/fishdish.sock'
+MAX_LINE = 4096
+
+
+class CommandError(Exception):
+    """Raised by a command handler to answer 'error <message>'"""
+
+
+class Server(object):
+    """Answers control commands on a Unix domain socket from an event loop.
+
+    :param path: socket file, replaced if it already exists
+    :param loop: eventloop.EventLoop to serve from
+    :param commands: handler(*args) by command name; a handler returns the text after 'ok' or raises CommandError
+    """
+
+    def __init__(self, path, loop, commands):
+        self.path = path
+        self.loop = loop
+        self.commands = commands
+        self.listener = None
+        self.clients = {}   # receive buffer by client socket (loop thread only)
+
+    def start(self):
+        """Binds the socket and starts serving (thread-safe)"""
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+        self.loop.call_soon_threadsafe(lambda: self.loop.add_reader(self.listener, self._accept, name='control'))
+
+    def close(self):
+        """Stops serving, disconnects the clients and removes the socket file (thread-safe)"""
+        def _close():
+            for client in list(self.clients):
+                self._drop(client)
+            if self.listener is not None:
+                self.loop.remove_reader(self.listener)
+                self.listener.close()
+                self.listener = None
+        self.loop.call_soon_threadsafe(_close)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        try:
+            client, _ = self.listener.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        client.setblocking(False)
+        self.clients[client] = ''
+        self.loop.add_reader(client, self._receive, client, name='control-client')
+
+    def _drop(self, client):
+        self.loop.remove_reader(client)
+        del self.clients[client]
+        client.close()
+
+    def _receive(self, client):
+        try:
+            data = client.recv(MAX_LINE)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._drop(client)
+            return
+        buffered = self.clients[client] + data
+        lines = buffered.split('\n')
+        self.clients[client] = lines.pop()
+        replies = [self.execute(line) for line in lines if line.strip()]
+        if len(self.clients[client]) > MAX_LINE:
+            replies.append('error line too long')
+            self.clients[client] = ''
+        if replies:
+            try:
+                # replies are short; a client that lets the socket buffer fill up is disconnected
+                client.send('\n'.join(replies) + '\n')
+            except socket.error:
+                self._drop(client)
+
+    def execute(self, line):
+        """Runs one command line and returns the reply line"""
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            return 'error ' + str(e)
+        handler = self.commands.get(words[0].lower())
+        if handler is None:
+            return 'error unknown command ' + words[0] + ', expected one of ' + ' '.join(sorted(self.commands))
+        try:
+            result = handler(*words[1:])
+        except CommandError as e:
+            return 'error ' + str(e)
+        except TypeError as e:
+            return 'error ' + words[0] + ': ' + str(e)
+        except Exception as e:
+            # a failing handler must still be answered, and must not take the other commands of the read with it
+            return 'error ' + type(e).__name__ + ': ' + str(e)
+        return 'ok' if result is None else 'ok ' + result
+
+
+def send(command, path=SOCKET_PATH, timeout=5.0):
+    """Sends one command line to a control socket and returns the reply line"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall(command.strip() + '\n')
+        reply = ''
+        while not reply.endswith('\n'):
+            data = client.recv(MAX_LINE)
+            if not data:
+                break
+            reply += data
+        return reply.strip()
+    finally:
+        client.close()
+
+
+def latency(command='ping', path=SOCKET_PATH, repeat=1000):
+    """Times command round trips over one connection.
+
+    :return: (median, worst) seconds
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    times = []
+    try:
+        for _ in range(repeat):
+            start = time.time()
+            client.sendall(command + '\n')
+            reply = ''
+            while not reply.endswith('\n'):
+                reply += client.recv(MAX_LINE)
+            times.append(time.time() - start)
+    finally:
+        client.close()
+    times.sort()
+    return times[len(times) // 2], times[-1]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Send a command to a running fishdish')
+    parser.add_argument('-s', '--socket', default=SOCKET_PATH, help='control socket (default ' + SOCKET_PATH + ')')
+    parser.add_argument('--repeat', type=int, default=0, metavar='N',
+                        help='send the command N times and report the round trip latency')
+    parser.add_argument('command', nargs='+')
+    args = parser.parse_args()
+    line = ' '.join(args.command)
+    if args.repeat:
+        median, worst = latency(line, args.socket, args.repeat)
+        print('median ' + str(round(median * 1e6)) + 'us, worst ' + str(round(worst * 1e6)) + 'us')
+    else:
+        print(send(line, args.socket))
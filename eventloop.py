@@ -0,0 +1,301 @@
+"""
+    Single-thread cooperative runtime for the Fish Dish effects
+    Python 2 has no asyncio, so coroutines are generators that yield the absolute monotonic deadline
+    (see clock.monotonic) at which they want to resume. The same generator can be driven by a plain thread
+    with clock.run_blocking() or scheduled with many others on one EventLoop thread.
+
+    The loop also serves as the timer service: call_later/call_every jobs are kept in the same heap, and
+    shared_loop() gives every module one timer thread instead of a thread per tick. Sockets registered with
+    add_reader are watched in the same select() call, so servers can run on the loop thread too.
+"""
+
+import heapq
+import select
+import _socket
+import errno
+import threading
+import itertools
+import math
+import clock
+
+
+def _socketpair():
+    # _socket rather than socket, which on Python 2 also loads OpenSSL (2MB resident) through _ssl
+    try:
+        return _socket.socketpair()
+    except AttributeError:
+        # Windows: emulate with a loopback connection
+        import socket
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(listener.getsockname())
+        server, _ = listener.accept()
+        listener.close()
+        return server, client
+
+
+class Task(object):
+    """A coroutine scheduled on an EventLoop"""
+
+    def __init__(self, loop, coroutine, name=''):
+        self.loop = loop
+        self.coroutine = coroutine
+        self.name = name
+        self.done = False
+        self.cancelled = False
+        self.error = None
+
+    def cancel(self):
+        """Stops the coroutine at its current yield, running its finally clauses (thread-safe)"""
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        if not self.done:
+            self.cancelled = True
+            self.done = True
+            try:
+                self.coroutine.close()
+            except Exception as e:
+                self.error = e
+                if self.loop.on_error is not None:
+                    self.loop.on_error(self, e)
+
+    def _step(self):
+        if self.done:
+            return
+        try:
+            deadline = next(self.coroutine)
+        except StopIteration:
+            self.done = True
+            return
+        except Exception as e:
+            self.done = True
+            self.error = e
+            if self.loop.on_error is not None:
+                self.loop.on_error(self, e)
+            return
+        self.loop._schedule(deadline, self._step)
+
+
+class Timer(object):
+    """A one-shot or fixed-rate periodic call scheduled on an EventLoop"""
+
+    def __init__(self, loop, deadline, interval, callback, args, name=''):
+        self.loop = loop
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.name = name
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the timer; a scheduled call is dropped when it falls due (thread-safe)"""
+        self.cancelled = True
+
+    def _fire(self):
+        if self.cancelled:
+            return
+        try:
+            if self.interval is not None:
+                # fixed rate: the next call is due one interval after the previous deadline, skipping missed ticks
+                self.deadline += self.interval
+                now = clock.monotonic()
+                if self.deadline <= now:
+                    self.deadline += self.interval * math.ceil((now - self.deadline) / self.interval)
+                self.loop._schedule(self.deadline, self._fire)
+            self.callback(*self.args)
+        except Exception as e:
+            if self.loop.on_error is not None:
+                self.loop.on_error(self, e)
+
+
+class Callback(object):
+    """A plain call queued or scheduled on an EventLoop"""
+
+    def __init__(self, loop, callback, args, name=''):
+        self.loop = loop
+        self.callback = callback
+        self.args = args
+        self.name = name or getattr(callback, '__name__', '')
+
+    def _fire(self):
+        try:
+            self.callback(*self.args)
+        except Exception as e:
+            if self.loop.on_error is not None:
+                self.loop.on_error(self, e)
+
+
+class Reader(Callback):
+    """A callback run on an EventLoop whenever a file object is readable"""
+
+    def __init__(self, loop, fileobj, callback, args, name=''):
+        Callback.__init__(self, loop, callback, args, name)
+        self.fileobj = fileobj
+
+
+class EventLoop(object):
+    """Runs scheduled callbacks and deadline coroutines on a single thread.
+
+    Other threads (e.g. GPIO edge callbacks) hand work to the loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, on_error=None):
+        """:param on_error: called with (task, timer, reader or callback, exception) when a coroutine or callback
+                         raises"""
+        self.on_error = on_error
+        self.tasks = []
+        self._timers = []
+        self._readers = {}
+        self._counter = itertools.count()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._wake_r, self._wake_w = _socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+    def _schedule(self, deadline, callback):
+        heapq.heappush(self._timers, (deadline, next(self._counter), callback))
+
+    def call_at(self, deadline, callback, *args):
+        """Calls callback(*args) on the loop thread at a monotonic deadline (loop thread only)"""
+        self._schedule(deadline, Callback(self, callback, args)._fire)
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        """Calls callback(*args) once after delay seconds (thread-safe).
+
+        :return: Timer that can be cancelled
+        """
+        timer = Timer(self, clock.monotonic() + delay, None, callback, args, kwargs.get('name', ''))
+        self.call_soon_threadsafe(self._schedule, timer.deadline, timer._fire)
+        return timer
+
+    def call_every(self, interval, callback, *args, **kwargs):
+        """Calls callback(*args) every interval seconds at a fixed rate, starting one interval from now (thread-safe).
+
+        :return: Timer that can be cancelled
+        :raises ValueError: if the interval is not positive
+        """
+        if not 0 < interval < float('inf'):
+            raise ValueError('timer interval must be positive, not ' + str(interval))
+        timer = Timer(self, clock.monotonic() + interval, interval, callback, args, kwargs.get('name', ''))
+        self.call_soon_threadsafe(self._schedule, timer.deadline, timer._fire)
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Queues callback(*args) to run on the loop thread and wakes the loop"""
+        with self._lock:
+            self._pending.append(Callback(self, callback, args))
+        try:
+            self._wake_w.send(b'!')
+        except _socket.error:
+            pass    # wakeup buffer full, the loop is already due to wake
+
+    def spawn(self, coroutine, name=''):
+        """Schedules a deadline generator to start now (thread-safe).
+
+        :return: Task that can be cancelled
+        """
+        task = Task(self, coroutine, name)
+        self.call_soon_threadsafe(self._start_task, task)
+        return task
+
+    def _start_task(self, task):
+        self.tasks.append(task)
+        task._step()
+
+    def add_reader(self, fileobj, callback, *args, **kwargs):
+        """Calls callback(*args) whenever fileobj (a socket on Windows) is readable (loop thread only).
+
+        :return: Reader
+        """
+        reader = Reader(self, fileobj, callback, args, kwargs.get('name', ''))
+        self._readers[fileobj] = reader
+        return reader
+
+    def remove_reader(self, fileobj):
+        """Stops watching fileobj (loop thread only)"""
+        self._readers.pop(fileobj, None)
+
+    def add_event_detect(self, GPIO, channel, edge, callback):
+        """Bridges a GPIO edge event so that callback(channel) runs on the loop thread"""
+        GPIO.add_event_detect(channel, edge, callback=lambda ch: self.call_soon_threadsafe(callback, ch))
+
+    def run(self):
+        """Runs the loop on the calling thread until stop() is called"""
+        self._running = True
+        while self._running:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for callback in pending:
+                callback._fire()
+            # only what was due at the start of the pass runs, so a coroutine that is behind schedule and
+            # reschedules itself in the past waits for the next pass instead of starving the readers
+            now = clock.monotonic()
+            due = []
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2])
+            for callback in due:
+                callback()
+            self.tasks = [task for task in self.tasks if not task.done]
+            if not self._running:
+                continue
+            timeout = None
+            if self._pending:
+                timeout = 0.0
+            elif self._timers:
+                timeout = max(0.0, self._timers[0][0] - clock.monotonic())
+            try:
+                ready, _, _ = select.select([self._wake_r] + list(self._readers), [], [], timeout)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                ready = []
+            for fileobj in ready:
+                if fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except _socket.error:
+                        pass
+                else:
+                    reader = self._readers.get(fileobj)
+                    if reader is not None:
+                        reader._fire()
+        for task in self.tasks:
+            task._cancel()
+        self.tasks = []
+
+    def start(self, name='eventloop'):
+        """Runs the loop on a daemon thread"""
+        self._thread = threading.Thread(name=name, target=self.run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the loop and cancels its remaining tasks (thread-safe)"""
+        def _stop():
+            self._running = False
+        self.call_soon_threadsafe(_stop)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop():
+    """Returns the process-wide timer service, starting its thread on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = EventLoop()
+            _shared.start(name='timers')
+        return _shared
+
@@ -7,34 +7,58 @@
 """
 
 # !/usr/bin/python
+import time
+_startup = [('start', time.time())]     # (phase, time) marks for --startup-trace
 import sys
 import os
-import time
-import logging
-from logging.handlers import RotatingFileHandler
 import threading
-import argparse
+import signal
+import errno
+from array import array
+from itertools import izip
+import clock
+import metrics
+# logging, argparse, eventloop, buzzer, ledpattern, songcache and rttl are imported where first used to keep them off the boot path
 
 
 global log
+log = None
+_log_debug = False  # log.isEnabledFor(DEBUG), checked by hot paths before building debug messages
+_log_writer = None  # logqueue.BufferedWriter that owns the log file
+
+# Low-memory profile for the smallest boards (see main's --low-memory). Checked here before the arguments are
+# parsed because the board simulator is chosen at import: the Tk GUI and its decoded photo are never loaded.
+_low_memory = '--low-memory' in sys.argv[1:] or bool(os.environ.get('FISHDISH_LOW_MEMORY'))
 
 global _rpi
+global _headless
+global _piezo
 global GPIO
 global fd
 
+# Without RPi.GPIO the board is simulated: with the Tk GUI and winsound on Windows,
+# otherwise (or with FISHDISH_HEADLESS set) headless with the buzzer driven through simulated PWM
 try:
     import RPi.GPIO as GPIO
     _rpi = True
+    _headless = False
+    _piezo = True
+    fd = None
 except ImportError:
-    if sys.platform.lower().startswith('win32'):
-        import simGPIO
+    import simGPIO
+    GPIO = simGPIO.GPIO()
+    _rpi = False
+    if sys.platform.lower().startswith('win32') and not os.environ.get('FISHDISH_HEADLESS') and not _low_memory:
         import simfishdish
         import winsound
-        GPIO = simGPIO.GPIO()
         fd = simfishdish.FishDish(GPIO)
-        _rpi = False
+        _headless = False
+        _piezo = False
     else:
-        sys.exit('Unsupported Operating System')
+        import simheadless
+        fd = simheadless.FishDish(GPIO)
+        _headless = True
+        _piezo = True
 
 # FishDish hardware map (BCM)
 LED_GRN = 4
@@ -46,9 +70,58 @@ BUTTON = 7
 global _debug
 global _shutting_down
 global _shutdown
+global _interrupted
 global startSong
 global endSong
 
+# Event loop driving songs, LEDs and the button when run with --eventloop, otherwise each effect gets a thread
+_loop = None
+
+# Debounce and hold detector for the shutdown button, created in main()
+_button = None
+
+# LED pattern scheduler (see leds())
+_leds = None
+
+# Song queue that owns the buzzer (see songs())
+_buzzer = None
+
+# Shutdown pipeline once the button has been held (see start_shutdown), and its profile
+_halt = None
+_shutdown_countdown = 5
+_shutdown_song = True
+
+# Index of the ringtones in SONG_DIR, only opened when a song is chosen by name (see library())
+_library = None
+
+# Runtime metrics, exported with --metrics-file or --metrics-port
+SONGS_PLAYED = metrics.Counter('fishdish_songs_played_total', 'Songs played to the end')
+NOTE_ERROR = metrics.Histogram('fishdish_note_start_error_seconds', 'Lateness of each note start')
+SONG_DRIFT = metrics.Histogram('fishdish_song_drift_seconds', 'Lateness of the end of each song')
+LED_FLASHES = metrics.Counter('fishdish_led_flashes_total', 'LED on/off cycles')
+EDGE_LATENCY = metrics.Histogram('fishdish_button_edge_latency_seconds',
+                                 'Time from a button edge callback until the edge is handled on the event loop')
+BUTTON_HOLDS = metrics.Counter('fishdish_button_presses_total', 'Button presses by debounce outcome',
+                               labels={'outcome': 'hold'})
+BUTTON_RELEASES = metrics.Counter('fishdish_button_presses_total', 'Button presses by debounce outcome',
+                                  labels={'outcome': 'released'})
+STARTUP = metrics.Gauge('fishdish_startup_seconds', 'Time from the start of the script until the button is armed')
+THREADS = metrics.Gauge('fishdish_threads', 'Live Python threads', threading.active_count)
+CPU = metrics.Gauge('fishdish_cpu_seconds', 'User and system CPU time used by the process',
+                    lambda: sum(os.times()[:2]))
+
+BUTTON_TO_HALT = metrics.Gauge('fishdish_button_to_halt_seconds',
+                               'Time from the shutdown button press until the system halt was started')
+
+# Self-pipe used to wake the idle main thread from a GPIO callback or signal handler. Python 2 on Windows cannot
+# interrupt a blocking read with Ctrl+C, so there the main thread waits on an event in timed steps instead.
+if sys.platform.lower().startswith('win32'):
+    _wake_event = threading.Event()
+else:
+    _wake_event = None
+    _wake_r, _wake_w = os.pipe()
+WAKE_POLL = 0.5     # seconds between checks for Ctrl+C on Windows
+
 '''
 logFileName = 'fishdish.log'
 if _rpi:
@@ -72,128 +145,64 @@ logging.basicConfig(filename=logFileName, level=logging.DEBUG,
                         datefmt='%Y-%m-%d %H:%M:%S')
 '''
 
+SONG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'songs')
+
 chargeRingtone = "Charge:d=4,o=5,b=108:8g4,8c,8e,8g.,16e,2g"
 
 smdRingtone = "SuperMarioDies:d=4,o=5,b=76:32c6,32c6,32c6,8p,16b,16f6,16p,16f6,16f.6,16e.6,16d6,16c6,16p,16e,16p,16c"
 
+# Low-memory limits: queued songs, and log records buffered and queued before records are dropped
+LOW_MEMORY_QUEUE = 2
+LOW_MEMORY_LOG_BUFFER = 50
+LOW_MEMORY_LOG_QUEUE = 500
+
+HALT_COMMAND = ['sudo', 'shutdown', '-h', 'now']
+
+# Shortest LED pattern period accepted from control clients, in seconds
+MIN_PATTERN_PERIOD = 0.05
+
+# Shutdown profiles: (countdown seconds, play the end song)
+SHUTDOWN_PROFILES = {
+    'graceful': (5, True),
+    'fast': (0, False),
+}
+
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def tone_table():
+    """Computes the equal-temperament tuning (A4 = 440Hz) of the RTTL notes C0 to B8.
+
+    MIDI note number 0, which no RTTL note uses, stands for a pause.
+    :return: (numbers, names, pitches) note numbers by name, names by number and pitches in Hz by number
+    """
+    numbers = {'P': 0}
+    names = ['P'] * 128
+    pitches = array('d', [0.0] * 128)
+    for number in range(12, 120):
+        name = NOTE_NAMES[number % 12] + str(number // 12 - 1)
+        numbers[name] = number
+        names[number] = name
+        pitches[number] = 440.0 * 2 ** ((number - 69) / 12.0)
+    return numbers, names, pitches
+
 
-class Song:
-    """An object with attributes for title, tempo, notes and durations."""
+class Song(object):
+    """An object with attributes for title, tempo, notes and durations.
+
+    Notes are stored as MIDI note numbers and durations as divisors, both in arrays; pitches are looked up
+    in a table computed once for all songs.
+    """
+
+    __slots__ = ('title', 'tempo', 'midi', 'durations', 'piezo', 'timing')
 
     global log
 
-    # Tones source: http://www.phy.mtu.edu/~suits/notefreqs.html
-    tones = {
-        'P': 0,
-        'C0': 16,
-        'C#0': 17,
-        'D0': 18,
-        'D#0': 20,
-        'E0': 21,
-        'F0': 22,
-        'F#0': 23,
-        'G0': 25,
-        'G#0': 26,
-        'A0': 28,
-        'A#0': 29,
-        'B0': 31,
-        'C1': 33,
-        'C#1': 35,
-        'D1': 37,
-        'D#1': 39,
-        'E1': 41,
-        'F1': 44,
-        'F#1': 46,
-        'G1': 49,
-        'G#1': 52,
-        'A1': 55,
-        'A#1': 58,
-        'B1': 62,
-        'C2': 65,
-        'C#2': 69,
-        'D2': 73,
-        'D#2': 78,
-        'E2': 82,
-        'F2': 87,
-        'F#2': 93,
-        'G2': 98,
-        'G#2': 104,
-        'A2': 110,
-        'A#2': 117,
-        'B2': 123,
-        'C3': 131,
-        'C#3': 139,
-        'D3': 147,
-        'D#3': 156,
-        'E3': 165,
-        'F3': 175,
-        'F#3': 185,
-        'G3': 196,
-        'G#3': 208,
-        'A3': 220,
-        'A#3': 233,
-        'B3': 247,
-        'C4': 262,
-        'C#4': 277,
-        'D4': 294,
-        'D#4': 311,
-        'E4': 330,
-        'F4': 349,
-        'F#4': 370,
-        'G4': 392,
-        'G#4': 415,
-        'A4': 440,
-        'A#4': 466,
-        'B4': 494,
-        'C5': 523,
-        'C#5': 554,
-        'D5': 587,
-        'D#5': 622,
-        'E5': 659,
-        'F5': 698,
-        'F#5': 740,
-        'G5': 784,
-        'G#5': 831,
-        'A5': 880,
-        'A#5': 932,
-        'B5': 988,
-        'C6': 1047,
-        'C#6': 1109,
-        'D6': 1175,
-        'D#6': 1245,
-        'E6': 1319,
-        'F6': 1397,
-        'F#6': 1480,
-        'G6': 1568,
-        'G#6': 1661,
-        'A6': 1760,
-        'A#6': 1865,
-        'B6': 1976,
-        'C7': 2093,
-        'C#7': 2217,
-        'D7': 2349,
-        'D#7': 2489,
-        'E7': 2637,
-        'F7': 2794,
-        'F#7': 2960,
-        'G7': 3136,
-        'G#7': 3322,
-        'A7': 3520,
-        'A#7': 3729,
-        'B7': 3951,
-        'C8': 4186,
-        'C#8': 4435,
-        'D8': 4699,
-        'D#8': 4978,
-        'E8': 5274,
-        'F8': 5588,
-        'F#8': 5920,
-        'G8': 6272,
-        'G#8': 6645,
-        'A8': 7040,
-        'A#8': 7459,
-        'B8': 7902
-    }
+    notenumbers, notenames, pitches = tone_table()
+
+    # Whole Hz pitch by RTTL note name, cf. http://www.phy.mtu.edu/~suits/notefreqs.html
+    tones = dict([(name, int(round(pitches[number]))) for name, number in notenumbers.iteritems()])
 
     # Tempo source: https://music.stackexchange.com/questions/4525/list-of-average-genre-tempo-bpm-levels
     tempos = {
@@ -210,98 +219,280 @@ class Song:
     def __init__(self, title='nil', tempo=108, piezo=False):
         self.title = title
         self.tempo = tempo  # Beats Per Minute
-        self.notes = []
-        self.durations = []
+        self.midi = array('B')        # MIDI note numbers, 0 for a pause
+        self.durations = array('H')   # note duration divisors
         self.piezo = piezo
+        self.timing = None
+
+    @property
+    def notes(self):
+        """Note names, e.g. 'C#5' or 'P' for a pause"""
+        return [self.notenames[number] for number in self.midi]
+
+    @property
+    def frequencies(self):
+        """Note pitches in Hz, 0 for a pause"""
+        pitches = self.pitches
+        return [pitches[number] for number in self.midi]
 
     def playsong(self):
-        """Plays the tune."""
-        if _debug: log.debug('Playing song: ' + self.title)
-        tempo = 108.0 / float(self.tempo)
-        notes = len(self.notes)
-        note = 0
-        while note < notes:
-            duration = tempo / float(self.durations[note])
-            if _debug: log.debug('Playing note ' + self.notes[note] + ' for ' + str(duration) + ' seconds.')
-            pitch = self.tones[self.notes[note]]
-            if pitch > 0:
-                if self.piezo:
-                    audible = GPIO.PWM(BUZZER, pitch)
-                    dcVolume = 1.0
-                    audible.start(dcVolume)   # volume is represented by Duty Cycle in the range 0..100
-                    time.sleep(duration)
-                    audible.stop()
-                else:
-                    winsound.Beep(pitch, int(duration * 1000))
-            else:
-                time.sleep(duration)
-            time.sleep(duration * 0.3)
-            note += 1
+        """Plays the tune on the calling thread (see playsong_co).
+
+        :return: (worst, drift) the latest note start and the end of song error in seconds
+        """
+        clock.run_blocking(self.playsong_co())
+        return self.timing
+
+    def playsong_co(self, notes=None):
+        """Coroutine that plays the tune with each note started at an absolute deadline so that timing errors
+        do not accumulate. Yields the monotonic deadlines it waits for and sets timing to (worst, drift) at the end.
 
-    def play(self):
-        songthread = threading.Thread(name='song' + self.title, target=self.playsong)
-        songthread.setDaemon(True)
-        songthread.start()
+        On the piezo a single PWM channel is retuned for every note and muted for pauses and articulation gaps.
+        Otherwise the song is rendered once to PCM and played in the background when NumPy is available
+        (see pcm), falling back to a blocking winsound.Beep per note, which is always used in low-memory mode.
+        :param notes: iterable of (MIDI number, divisor) to play in place of the song's own notes, e.g. a stream
+                      that is read during the gaps between notes (never rendered to PCM)
+        """
+        if _log_debug: log.debug('Playing song: ' + self.title)
+        beat = 108.0 / float(self.tempo)
+        pitches = self.pitches
+        audible = None
+        player = None
+        if self.piezo:
+            audible = GPIO.PWM(BUZZER, 1000)
+            audible.start(0)    # volume is represented by Duty Cycle in the range 0..100
+        elif notes is None and not _low_memory:
+            import pcm
+            if pcm.numpy is not None:
+                player = pcm.Player(pcm.wavfile(self.tempo, self.frequencies, self.durations))
+        if notes is None:
+            notes = izip(self.midi, self.durations)
+        dcVolume = 1.0
+        worst = 0.0
+        deadline = clock.monotonic()
+        try:
+            for number, divisor in notes:
+                duration = beat / divisor
+                pitch = pitches[number]
+                if _log_debug: log.debug('Playing ' + str(pitch) + 'Hz for ' + str(duration) + ' seconds.')
+                yield deadline
+                error = clock.monotonic() - deadline
+                NOTE_ERROR.observe(error)
+                if error > worst:
+                    worst = error
+                if pitch > 0:
+                    if audible is not None:
+                        audible.ChangeFrequency(pitch)
+                        audible.ChangeDutyCycle(dcVolume)
+                        yield deadline + duration
+                        audible.ChangeDutyCycle(0)
+                    elif player is None:
+                        winsound.Beep(int(round(pitch)), int(duration * 1000))
+                deadline += duration * 1.3
+            yield deadline
+            drift = clock.monotonic() - deadline
+            if player is not None:
+                player.detach()     # finished, let the audio tail play out
+                player = None
+        finally:
+            if audible is not None:
+                audible.stop()
+            if player is not None:
+                player.stop()
+        self.timing = (worst, drift)
+        SONGS_PLAYED.inc()
+        SONG_DRIFT.observe(drift)
+        log.info('Song ' + self.title + ' timing: worst note start error ' + str(round(worst * 1000, 3)) +
+                 'ms, cumulative error ' + str(round(drift * 1000, 3)) + 'ms')
+
+    def render(self, waveform='square'):
+        """Renders the tune to 16 bit PCM samples with NumPy, cached by song hash (see pcm.render)"""
+        import pcm
+        return pcm.render(self.tempo, self.frequencies, self.durations, waveform)
+
+    def export(self, path, waveform='square'):
+        """Writes the tune to a WAV file"""
+        import pcm
+        pcm.export(self.render(waveform), path)
+
+    def play(self, priority=0, policy='queue', window=0.0):
+        """Plays the tune in the background through the buzzer's song queue (see songs() and buzzer.Buzzer.play).
+
+        :param priority: higher priority songs are played first
+        :param policy: 'preempt', 'queue' or 'drop' when another song is playing
+        :param window: drop the request if the song is queued, playing or was started this many seconds ago
+        :return: buzzer.Request that completes when the song has been played or stopped
+        """
+        return songs().play(self, priority, policy, window)
 
     def parseRTTL(self, ringtone):
         """Parses the Nokia RTTL format text file to create a song made of tempo, notes and durations.
 
         Ringtone file format: https://en.wikipedia.org/wiki/Ring_Tone_Transfer_Language
         :param ringtone: an RTTL compliant text string/file
-        :return: song dictionary with title, BPM (tempo), notes, durations (divisors)
+        :raises rttl.RTTLError: if the ringtone is malformed, with the position of the error
         """
-        # noteDurations = [1, 2, 4, 8, 16, 32]
-        self.title = ringtone.split(':')[0].strip()
-        defaults = ringtone.split(':')[1].strip()
-        melody = ringtone.split(':')[2]
-        defaultDuration = defaults.split(',')[0].strip().replace('d=', '')
-        defaultOctave = defaults.split(',')[1].strip().replace('o=', '')
-        self.tempo = int(defaults.split(',')[2].strip().replace('b=', ''))
-        melodyNotes = melody.split(',')
-        for melodyNote in melodyNotes:
-            melodyNote = melodyNote.strip()
-            strPos = 0
-            noteFound = False
-            isOctave = False
-            duration = ''
-            note = ''
-            octave = ''
-            while strPos < len(melodyNote) and not noteFound:
-                try:
-                    if int(melodyNote[strPos]) in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                        duration += melodyNote[strPos]
-                except:
-                    if melodyNote[strPos].lower() in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'p']:
-                        noteFound = True
-                        note += melodyNote[strPos].upper()
-                strPos += 1
-            if duration == '':
-                duration = defaultDuration
-            duration = int(duration)
-            while strPos < len(melodyNote) and not isOctave:
-                try:
-                    if int(melodyNote[strPos]) in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                        isOctave = True
-                        octave = melodyNote[strPos]
-                except:
-                    if melodyNote[strPos] == '#':
-                        note += melodyNote[strPos]
-                    elif melodyNote[strPos] == '.':
-                        duration = int(1.0/(1.0/float(duration) * 1.5))
-                    else:
-                        log.error('Unidentified character/order while parsing RTTL.')
-                strPos += 1
-            if note != 'P':
-                if isOctave:
-                    note += octave
-                else:
-                    note += defaultOctave
-            self.notes.append(note)
-            self.durations.append(duration)
+        import rttl
+        self.title, self.tempo, notes, durations = rttl.parse(ringtone)
+        numbers = self.notenumbers
+        for note in notes:
+            if note not in numbers:
+                log.error('Unknown note ' + note + ' while parsing RTTL, substituting a pause.')
+        self.midi = array('B', [numbers.get(note, 0) for note in notes])
+        self.durations = array('H', durations)
+
+    def compile(self, path, key):
+        """Writes the parsed song to a compiled cache file (see songcache)."""
+        import songcache
+        songcache.store(path, key, self.title, self.tempo, self.midi, self.durations)
+
+    def loadcompiled(self, path, key):
+        """Loads the song from a compiled cache file.
+
+        :return: True if the cache was valid for the source hash, otherwise False
+        """
+        import songcache
+        compiled = songcache.load(path, key)
+        if compiled is None:
+            return False
+        self.title, self.tempo, self.midi, self.durations = compiled
+        return True
+
+
+def loadsong(source, piezo=False):
+    """Creates a Song from a RTTL string or file, only parsing it when its compiled cache is missing or stale.
+
+    The cache of a RTTL file is stored next to it, a RTTL string is cached in SONG_DIR under its content hash
+    (never its title, which comes from the caller and could name any path).
+    :param source: an RTTL compliant text string or the path of a RTTL file
+    :param piezo: play the song on the piezo buzzer
+    :return: Song
+    """
+    import binascii
+    import songcache
+    if os.path.isfile(source):
+        with open(source) as f:
+            ringtone = f.read()
+        cache = songcache.cachepath(source)
+    else:
+        ringtone = source
+        cache = None
+    key = songcache.digest(ringtone)
+    if cache is None:
+        cache = os.path.join(SONG_DIR, binascii.hexlify(key) + songcache.EXTENSION)
+    song = Song(piezo=piezo)
+    if not song.loadcompiled(cache, key):
+        song.parseRTTL(ringtone)
+        try:
+            song.compile(cache, key)
+        except (IOError, OSError, ValueError) as e:
+            log.warning('Unable to cache compiled song ' + song.title + ': ' + str(e))
+    return song
+
+
+def notenumbers(notes):
+    """Converts (note name, divisor) pairs to (MIDI number, divisor), substituting pauses for unknown notes"""
+    numbers = Song.notenumbers
+    for note, divisor in notes:
+        number = numbers.get(note)
+        if number is None:
+            log.error('Unknown note ' + note + ' while parsing RTTL, substituting a pause.')
+            number = 0
+        yield number, divisor
+
+
+def streamsong(source, piezo=False):
+    """Plays every ringtone of a RTTL string or file on the calling thread while it is read (see streamsong_co)"""
+    clock.run_blocking(streamsong_co(source, piezo))
+
+
+def streamsong_co(source, piezo=False):
+    """Coroutine that plays the ringtones of a RTTL string or file one after the other as they are parsed.
+
+    Playback starts as soon as the first header and note have been read and only the current note is held in
+    memory, so long or concatenated ringtone files start at once. Yields monotonic deadlines.
+    :param source: RTTL text with one or more ringtones, or the path of a RTTL file
+    :raises rttl.RTTLError: when a malformed ringtone is reached
+    """
+    import rttl
+    stream = open(source) if os.path.isfile(source) else None
+    try:
+        for title, tempo, notes in rttl.stream(stream or source):
+            performance = Song(title, tempo, piezo).playsong_co(notenumbers(notes))
+            try:
+                for deadline in performance:
+                    yield deadline
+            finally:
+                performance.close()
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def library():
+    """Returns the ringtone library index of SONG_DIR, opened on first use"""
+    global _library
+    if _library is None:
+        import library as songlibrary
+        _library = songlibrary.Library(SONG_DIR, Song.tones)
+    return _library
+
+
+def choosesong(query, default, piezo=False):
+    """Loads a song from the library by title, or with '<SECONDS' the longest one playing for at most SECONDS.
+
+    :param default: RTTL string played when nothing in the library matches
+    :return: Song
+    """
+    try:
+        entry = library().choose(query)
+        if entry is not None:
+            return loadsong(library().read(entry), piezo=piezo)
+        log.warning('No song in ' + SONG_DIR + ' matches ' + query + ', using the default.')
+    except (ValueError, KeyError, IOError, OSError) as e:
+        log.warning('Unable to load song ' + query + ': ' + str(e))
+    return loadsong(default, piezo=piezo)
+
+
+def leds():
+    """Returns the LED pattern scheduler, on the event loop if one is running else on the shared timer loop"""
+    global _leds
+    if _leds is None:
+        import eventloop
+        import ledpattern
+        _leds = ledpattern.Scheduler(GPIO, _loop or eventloop.shared_loop())
+    return _leds
+
+
+def songs():
+    """Returns the song queue that owns the buzzer, on the event loop if one is running else on the shared
+    timer loop"""
+    global _buzzer
+    if _buzzer is None:
+        import eventloop
+        import buzzer
+        _buzzer = buzzer.Buzzer(_loop or eventloop.shared_loop(), maxsize=LOW_MEMORY_QUEUE if _low_memory else 8)
+    return _buzzer
 
 
 def flashled(ledpin=LED_GRN, frequency=1.0, cycles=1):
-    """Toggles a LED """
+    """Toggles a LED on the LED pattern scheduler, waiting until done unless cycles=0 (flash until cancelled).
+
+    :return: ledpattern.Playback that can be cancelled
+    """
+    import ledpattern
+    playback = leds().play(ledpattern.blink(ledpin, frequency, cycles))
+    if cycles > 0:
+        playback.wait()
+        LED_FLASHES.inc(cycles)
+    return playback
+
+
+def flashled_co(ledpin=LED_GRN, frequency=1.0, cycles=1):
+    """Coroutine that toggles a LED, cycles=0 flashes until cancelled. Yields monotonic deadlines.
+
+    Used for the first flash, which is lit before the event loop and LED pattern scheduler are loaded.
+    """
 
     global GPIO
     # global _shutting_down
@@ -312,60 +503,306 @@ def flashled(ledpin=LED_GRN, frequency=1.0, cycles=1):
     elif cycles == 0:
         tick = 1
     led_state = False
-    while tick > 0:
-        if not led_state:
-            GPIO.output(ledpin, GPIO.HIGH)
-            led_state = True
-        else:
+    deadline = clock.monotonic()
+    try:
+        while tick > 0:
+            if not led_state:
+                GPIO.output(ledpin, GPIO.HIGH)
+                led_state = True
+            else:
+                GPIO.output(ledpin, GPIO.LOW)
+                led_state = False
+                tick -= 1
+                LED_FLASHES.inc()
+            if cycles == 0:
+                tick = 1
+            deadline += frequency / 2.0
+            yield deadline
+    finally:
+        if led_state:
             GPIO.output(ledpin, GPIO.LOW)
-            led_state = False
-            tick -= 1
-        if cycles == 0:
-            tick = 1
-        time.sleep(frequency / 2.0)
 
 
 def shutdown(channel):
-    """ Callback function for a GPIO input event requesting graceful shutdown """
+    """ Callback function for a GPIO input event requesting graceful shutdown
 
-    global _debug
-    global _rpi
-    global log
-    global GPIO
+    Returns at once: the button hold is timed on the event loop (see button.ButtonHold), which calls
+    halt_requested once the button has been held for the hold time.
+    """
+    _button.edge(channel)
+
+
+def halt_requested(channel):
+    """Starts the shutdown sequence on the button's event loop"""
     global _shutting_down
+    BUTTON_HOLDS.inc()
+    if not _shutting_down:
+        _shutting_down = True
+        start_shutdown(channel)
+
+
+def button_released(channel, held):
+    """Reports a button release before the hold time"""
+    BUTTON_RELEASES.inc()
+    if _debug:
+        print('Input button released after ' + str(int(held * 1000)) + 'ms. Shutdown avoided.')
+
+
+def start_shutdown(channel):
+    """Starts the shutdown pipeline on the button's event loop, timed from the button press.
+
+    confirm (countdown) and notify (end song) run in parallel; the logs are synced once both are done and the
+    system is halted last.
+    """
+    global _halt
+    import halt
+    if _debug: print("Halt request via GPIO input #" + str(channel))
+    log.info("Halt request via GPIO input #" + str(channel))
+    stages = [
+        halt.Stage('confirm', confirm_shutdown),
+        halt.Stage('notify', notify_shutdown),
+        halt.Stage('flush', flush_logs, after=('confirm', 'notify')),
+        halt.Stage('halt', halt_system, after=('flush',)),
+    ]
+    _halt = halt.Pipeline(_button.loop, stages, origin=_button.pressed_at, on_stage=shutdown_stage_done).start()
+
+
+def shutdown_stage_done(name, started, finished):
+    """Logs the time taken by a shutdown stage"""
+    error = _halt.errors.get(name) if _halt is not None else None
+    if error is not None:
+        log.error('Shutdown stage ' + name + ' failed: ' + type(error).__name__ + ': ' + str(error))
+    log.info('Shutdown stage ' + name + ' took ' + str(round((finished - started) * 1000, 1)) + 'ms, done ' +
+             str(round(finished * 1000, 1)) + 'ms after the button press')
+    if name == 'halt':
+        BUTTON_TO_HALT.set(finished)
+
+
+def confirm_shutdown():
+    """Shutdown stage: counts down on the red LED, then leaves it lit"""
+    import ledpattern
+    if _shutdown_countdown > 0:
+        return countdown_co(_shutdown_countdown)
+    leds().set(LED_RED, ledpattern.ON)
+
+
+def countdown_co(seconds):
+    """Coroutine that flashes the red LED once per second remaining, then leaves it lit"""
+    import ledpattern
+    deadline = clock.monotonic()
+    leds().play(ledpattern.countdown(LED_RED, seconds), start=deadline)
+    tick = seconds
+    while tick > 0:
+        if _debug: print("WARNING: system shutdown in " + str(tick) + " seconds")
+        deadline += 1.0
+        yield deadline
+        tick -= 1
+    # the red LED stays on once the countdown pattern has ended
+    leds().set(LED_RED, ledpattern.ON)
+
+
+def notify_shutdown():
+    """Shutdown stage: plays the end song, or silences the buzzer when the profile skips it"""
+    if _shutdown_song and endSong is not None:
+        return endSong.play(priority=1, policy='preempt')
+    songs().stop()
+
+
+def flush_logs():
+    """Shutdown stage: writes the buffered log records to storage"""
+    if _log_writer is not None:
+        return _log_writer.sync()
+
+
+def halt_system():
+    """Shutdown stage: halts the system (only on the Pi and not in debug mode) and wakes the main thread"""
     global _shutdown
-    global endSong
+    try:
+        if _rpi and not _debug:
+            import subprocess
+            # executed directly rather than through a shell; shutdown signals this process once it has started
+            subprocess.Popen(HALT_COMMAND)
+    finally:
+        # the main thread cleans up and exits even when the halt could not be started
+        _shutdown = True
+        wake_main()
+
 
-    SD_DEBOUNCE = 3
-    SD_COUNTDOWN = 5
+def loop_error(task, e):
+    """Logs an exception raised by a coroutine, timer or reader on an event loop"""
+    log.error('Error in ' + task.name + ': ' + type(e).__name__ + ': ' + str(e))
 
-    debounce_count = 0
-    while debounce_count < SD_DEBOUNCE:
-        if not GPIO.input(BUTTON):
-            if _debug:
-                print('Input button not held high. Shutdown avoided.')
+
+def wake_main():
+    """Wakes the main thread blocked in idle_wait"""
+    if _wake_event is not None:
+        _wake_event.set()
+    else:
+        os.write(_wake_w, b'!')
+
+
+def idle_wait():
+    """Blocks the main thread without using CPU until wake_main is called"""
+    if _wake_event is not None:
+        # the signal handlers run between the timed waits
+        while not _wake_event.wait(WAKE_POLL):
+            pass
+        _wake_event.clear()
+        return
+    while True:
+        try:
+            os.read(_wake_r, 1)
             return
-        if _debug:
-            print('Button debounce count: ' + str(debounce_count))
-        debounce_count += 1
-        time.sleep(1)
+        except OSError as e:
+            # a signal arrived while blocked; its handler has already run
+            if e.errno != errno.EINTR:
+                raise
 
-    if not _shutting_down:
-        if _debug: print("Halt request via GPIO input #" + str(BUTTON))
-        log.info("Halt request via GPIO input #" + str(BUTTON))
-        if endSong is not None:
-            endSong.play()
-        _shutting_down = True
-        tick = SD_COUNTDOWN
-        while tick > 0:
-            if _debug: print("WARNING: system shutdown in " + str(tick) + " seconds")
-            GPIO.output(LED_RED, GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(LED_RED, GPIO.LOW)
-            time.sleep(0.5)
-            tick -= 1
-        GPIO.output(LED_RED, GPIO.HIGH)
-        _shutdown = True
+
+def on_signal(signum, frame):
+    """Signal handler for SIGTERM/SIGINT that stops the program without halting the system"""
+    global _interrupted
+    _interrupted = signum
+    wake_main()
+
+
+def resume(deadline, coroutine):
+    """Coroutine that waits for deadline, then continues a deadline coroutine that was already started"""
+    yield deadline
+    for deadline in coroutine:
+        yield deadline
+
+
+def trace(phase):
+    """Marks the end of a start-up phase for --startup-trace"""
+    _startup.append((phase, time.time()))
+
+
+def process_started():
+    """Returns the approximate time the process was started (10ms resolution) on Linux, otherwise None"""
+    try:
+        with open('/proc/self/stat') as f:
+            started = float(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return time.time() - (uptime - started)
+
+
+def startup_report():
+    """Formats the start-up phases with the time each took and the time since the process started"""
+    marks = list(_startup)
+    origin = process_started()
+    if origin is not None and origin < marks[0][1]:
+        marks.insert(0, ('process', origin))
+        marks[1] = ('interpreter', marks[1][1])
+    lines = []
+    for i in range(1, len(marks)):
+        phase, at = marks[i]
+        lines.append(phase + ': ' + str(round((at - marks[i - 1][1]) * 1000, 1)) + 'ms (at ' +
+                     str(round((at - marks[0][1]) * 1000, 1)) + 'ms)')
+    return '\n'.join(lines)
+
+
+def control_commands(loaded):
+    """Returns the commands of the control socket (see control.Server), run on the LED and song loop thread.
+
+    :param loaded: dictionary of Songs by title, extended with the library songs as they are played by name
+    """
+    import json
+    import control
+    import ledpattern
+
+    def number(text, name, convert=float, zero=False, minimum=None):
+        """Converts a command argument that must be positive (or zero), finite and at least minimum if given"""
+        try:
+            value = convert(text)
+        except (ValueError, OverflowError):
+            raise control.CommandError(name + ' must be a number, not ' + str(text))
+        if not (0 <= value if zero else 0 < value) or value == float('inf'):
+            raise control.CommandError(name + ' must be ' + ('zero or more' if zero else 'positive') +
+                                       ' and finite, not ' + str(text))
+        if minimum is not None and value < minimum:
+            raise control.CommandError(name + ' must be at least ' + str(minimum) + ', not ' + str(text))
+        return value
+
+    def period(text):
+        return number(text, 'period', minimum=MIN_PATTERN_PERIOD)
+
+    led_names = {'grn': LED_GRN, 'yel': LED_YEL, 'red': LED_RED}
+    patterns = {
+        'blink': lambda led, seconds=1.0, cycles=0: ledpattern.blink(led, period(seconds),
+                                                                     number(cycles, 'cycles', int, zero=True)),
+        'heartbeat': lambda led, seconds=1.2: ledpattern.heartbeat(led, period(seconds)),
+        'countdown': lambda led, seconds=5: ledpattern.countdown(led, number(seconds, 'seconds', int)),
+        'breathe': lambda led, seconds=3.0: ledpattern.breathe(led, period(seconds)),
+    }
+
+    def play(name, priority=0, policy='queue', window=0.0):
+        """play <title or RTTL> [priority] [preempt|queue|drop] [window seconds]"""
+        song = loaded.get(name)
+        if song is None:
+            try:
+                if ':' in name:
+                    # ad-hoc RTTL is parsed but neither cached nor ever opened as a path
+                    song = Song(piezo=_piezo)
+                    song.parseRTTL(name)
+                else:
+                    entry = library().get(name)
+                    if entry is None:
+                        raise control.CommandError('unknown song ' + name)
+                    song = loaded[name] = loadsong(library().read(entry), piezo=_piezo)
+            except (ValueError, KeyError, IOError) as e:
+                raise control.CommandError(str(e))
+        if policy not in ('preempt', 'queue', 'drop'):
+            raise control.CommandError('unknown policy ' + policy)
+        try:
+            priority = int(priority)
+        except ValueError:
+            raise control.CommandError('priority must be an integer, not ' + priority)
+        song.play(priority, policy, number(window, 'window', zero=True))
+
+    def led(pattern, name, *args):
+        """led <blink|heartbeat|countdown|breathe|on|off|stop> <grn|yel|red> [pattern arguments]"""
+        ledpin = led_names.get(name)
+        if ledpin is None:
+            raise control.CommandError('unknown LED ' + name)
+        if pattern == 'stop':
+            leds().cancel(ledpin)
+        elif pattern in ('on', 'off'):
+            leds().set(ledpin, ledpattern.ON if pattern == 'on' else ledpattern.OFF)
+        elif pattern in patterns:
+            try:
+                leds().play(patterns[pattern](ledpin, *args))
+            except ValueError as e:
+                raise control.CommandError(str(e))
+        else:
+            raise control.CommandError('unknown pattern ' + pattern)
+
+    def stop():
+        """stop: stops all songs and LED patterns"""
+        songs().stop()
+        leds().cancel()
+
+    def status():
+        """status: JSON of the song playing and queued, LED levels and the shutdown state"""
+        current = songs().current
+        return json.dumps({
+            'playing': current.song.title if current is not None else None,
+            'queued': [request.song.title for _, _, request in sorted(songs().queue)],
+            'leds': dict((name, leds().level(ledpin)) for name, ledpin in led_names.items()),
+            'shutting_down': _shutting_down,
+            'songs': sorted(set(loaded) | set(entry['title'] for entry in library().find())),
+        }, sort_keys=True)
+
+    return {
+        'ping': lambda: 'pong',
+        'play': play,
+        'led': led,
+        'stop': stop,
+        'status': status,
+    }
 
 
 def splash():
@@ -384,85 +821,241 @@ def main():
     global _debug
     global log
     global _rpi
+    global _piezo
     global GPIO
     global fd
     global _shutting_down
     global _shutdown
+    global _interrupted
+    global _loop
+    global _button
+    global _leds
+    global _buzzer
+    global _log_debug
+    global _log_writer
     global startSong
     global endSong
+    global _halt
+    global _shutdown_countdown
+    global _shutdown_song
+    global _library
 
+    metrics_file = None
+    metrics_server = None
+    control_server = None
     _shutting_down = False
     _shutdown = False
+    _interrupted = None
+    trace('imports')
 
-    # Derive run options from command line
-    parser = argparse.ArgumentParser(description='Fishdish GPIO interface')
-    parser.add_argument('-d', '--debug', dest='debug', action='store_true', help='run in debug mode (virtual shutdown)')
-    # TODO: add some parameters to optionally customize/validate the tune played on startup and shutdown
+    try:
+        # GPIO and the first green flash come first, everything else is deferred until the LED is lit
+        GPIO.setmode(GPIO.BCM)
 
-    args = parser.parse_args()
-    # _debug = args.debug
+        leds = [LED_GRN, LED_YEL, LED_RED]
+        GPIO.setup(leds, GPIO.OUT)
+        GPIO.setup(BUZZER, GPIO.OUT)
 
-    logFileName = 'fishdish.log'
+        for led in leds:
+            GPIO.output(led, GPIO.LOW)
 
-    if _rpi:
-        logFileName = '/home/pi/' + logFileName
+        init_flash = flashled_co(LED_GRN, 1.0, 3)
+        init_flash = resume(next(init_flash), init_flash)
+        trace('first flash')
 
-    log_formatter = logging.Formatter(fmt='%(asctime)s.%(msecs)03d,(%(threadName)-10s),' \
-                                          '[%(levelname)s],%(funcName)s(%(lineno)d),%(message)s',
-                                      datefmt='%Y-%m-%d %H:%M:%S')
-    log_handler = RotatingFileHandler(logFileName, mode='a', maxBytes=5 * 1024 * 1024,
-                                      backupCount=2, encoding=None, delay=0)
-    log_handler.setFormatter(log_formatter)
-    log_handler.setLevel(logging.DEBUG)
-    log = logging.getLogger(logFileName)
-    log.setLevel(logging.DEBUG)
-    log.addHandler(log_handler)
+        # Derive run options from command line
+        import argparse
 
-    if _debug:
-        log.info('Debug enabled')
-        splash()
+        def positive(text):
+            """Argument type of a number that must be positive and finite"""
+            value = float(text)
+            if not 0 < value < float('inf'):
+                raise argparse.ArgumentTypeError('must be positive and finite, not ' + text)
+            return value
 
-    if not _rpi:
-        log.info('Error importing RPi.GPIO library. Simulating GPIO/Fishdish for Windows.')
+        parser = argparse.ArgumentParser(description='Fishdish GPIO interface')
+        parser.add_argument('-d', '--debug', dest='debug', action='store_true',
+                            help='run in debug mode (virtual shutdown)')
+        parser.add_argument('--sim-press', dest='sim_press', type=float, default=None, metavar='SECONDS',
+                            help='headless simulation: hold the button down SECONDS after start-up to request shutdown')
+        parser.add_argument('-e', '--eventloop', dest='eventloop', action='store_true',
+                            help='drive songs, LEDs and the button from a single event loop thread')
+        parser.add_argument('--hold-time', dest='hold_time', type=float, default=3.0, metavar='SECONDS',
+                            help='how long the button must be held to shut down (default 3)')
+        parser.add_argument('--sample-rate', dest='sample_rate', type=positive, default=100.0, metavar='HZ',
+                            help='how often the held button is sampled (default 100)')
+        parser.add_argument('--audio', dest='audio', choices=['piezo', 'pcm'], default=None,
+                            help='piezo: drive the buzzer with PWM, pcm: render songs with NumPy and play them on '
+                                 'the default sound card with aplay (default piezo, pcm on the Windows simulator)')
+        parser.add_argument('--log-level', dest='log_level', default='INFO',
+                            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='log file level (default INFO)')
+        parser.add_argument('--log-flush', dest='log_flush', type=float, default=10.0, metavar='SECONDS',
+                            help='longest time log records are held in memory before being written (default 10)')
+        parser.add_argument('--metrics-file', dest='metrics_file', metavar='PATH',
+                            help='write runtime metrics in the Prometheus text format to PATH')
+        parser.add_argument('--metrics-interval', dest='metrics_interval', type=positive, default=15.0,
+                            metavar='SECONDS', help='how often the metrics file is rewritten (default 15)')
+        parser.add_argument('--metrics-port', dest='metrics_port', type=int, metavar='PORT',
+                            help='serve runtime metrics over HTTP on localhost:PORT')
+        parser.add_argument('--control', dest='control', nargs='?', const='/tmp/fishdish.sock', metavar='SOCKET',
+                            help='accept song, LED and status commands on a Unix socket (default /tmp/fishdish.sock)')
+        parser.add_argument('--low-memory', dest='low_memory', action='store_true',
+                            help='small footprint: one event loop thread for everything, short song and log '
+                                 'queues, no PCM rendering or GUI simulator (also FISHDISH_LOW_MEMORY=1)')
+        parser.add_argument('--startup-trace', dest='startup_trace', action='store_true',
+                            help='report the time taken by each start-up phase')
+        parser.add_argument('--shutdown-profile', dest='shutdown_profile', default='graceful',
+                            choices=sorted(SHUTDOWN_PROFILES),
+                            help='graceful: end song and 5 second countdown, fast: halt as soon as the logs are '
+                                 'synced (default graceful)')
+        parser.add_argument('--countdown', dest='countdown', type=int, default=None, metavar='SECONDS',
+                            help='override the shutdown countdown of the profile')
+        parser.add_argument('--start-song', dest='start_song', metavar='TITLE|<SECONDS',
+                            help='play this song from ' + SONG_DIR + ' on start-up, by title or as the longest '
+                                 'one shorter than SECONDS')
+        parser.add_argument('--end-song', dest='end_song', metavar='TITLE|<SECONDS',
+                            help='play this song from ' + SONG_DIR + ' on shutdown, by title or as the longest '
+                                 'one shorter than SECONDS')
 
-    startSong = Song(piezo=_rpi)
-    startSong.parseRTTL(chargeRingtone)
+        args = parser.parse_args()
+        _shutdown_countdown, _shutdown_song = SHUTDOWN_PROFILES[args.shutdown_profile]
+        if args.countdown is not None:
+            _shutdown_countdown = args.countdown
+        # _debug = args.debug
+        trace('arguments')
 
-    endSong = Song(piezo=_rpi)
-    endSong.parseRTTL(smdRingtone)
+        import logging
+        import logqueue
 
-    try:
-        GPIO.setmode(GPIO.BCM)
+        logFileName = 'fishdish.log'
 
-        leds = [LED_GRN, LED_YEL, LED_RED]
-        GPIO.setup(leds, GPIO.OUT)
-        GPIO.setup(BUZZER, GPIO.OUT)
+        if _rpi:
+            logFileName = '/home/pi/' + logFileName
 
-        for led in leds:
-            GPIO.output(led, GPIO.LOW)
+        log_formatter = logging.Formatter(fmt='%(asctime)s.%(msecs)03d,(%(threadName)-10s),' \
+                                              '[%(levelname)s],%(funcName)s(%(lineno)d),%(message)s',
+                                          datefmt='%Y-%m-%d %H:%M:%S')
+        if _low_memory:
+            log_handler = logqueue.SizeRotatingFileHandler(logFileName, maxBytes=5 * 1024 * 1024, backupCount=2)
+        else:
+            from logging.handlers import RotatingFileHandler
+            log_handler = RotatingFileHandler(logFileName, mode='a', maxBytes=5 * 1024 * 1024,
+                                              backupCount=2, encoding=None, delay=0)
+        log_handler.setFormatter(log_formatter)
+        log_handler.setLevel(logging.DEBUG)
+        # the file is written by a background thread so that storage latency stays off the playback path
+        if _low_memory:
+            _log_writer = logqueue.BufferedWriter([log_handler], flush_interval=args.log_flush,
+                                                  capacity=LOW_MEMORY_LOG_BUFFER, maxsize=LOW_MEMORY_LOG_QUEUE)
+        else:
+            _log_writer = logqueue.BufferedWriter([log_handler], flush_interval=args.log_flush)
+        _log_writer.start()
+        log = logging.getLogger(logFileName)
+        log.setLevel(getattr(logging, args.log_level))
+        log.addHandler(logqueue.QueueHandler(_log_writer.queue))
+        _log_debug = log.isEnabledFor(logging.DEBUG)
+        trace('logging')
+
+        # songs, LED patterns, the button and control commands run on the shared timer loop unless --eventloop
+        import eventloop
+        eventloop.shared_loop().on_error = loop_error
+
+        if _low_memory:
+            # the timer service thread also runs the songs, LEDs and button
+            _loop = eventloop.shared_loop()
+            _loop.spawn(init_flash, name='init_flash')
+        elif args.eventloop:
+            _loop = eventloop.EventLoop(on_error=loop_error)
+            _loop.start()
+            _loop.spawn(init_flash, name='init_flash')
+        else:
+            # if isinstance(threading.current_thread(), threading._MainThread):
+            init_flash = threading.Thread(name='init_flash', target=clock.run_blocking, args=(init_flash,))
+            init_flash.setDaemon(True)
+            init_flash.start()
+            # flashled(LED_GRN, 1.0, 3)
 
-        # if isinstance(threading.current_thread(), threading._MainThread):
-        init_flash = threading.Thread(name='init_flash', target=flashled, args=(LED_GRN, 1.0, 3))
-        init_flash.setDaemon(True)
-        init_flash.start()
-        # flashled(LED_GRN, 1.0, 3)
+        if _debug:
+            log.info('Debug enabled')
+            splash()
+
+        if _headless:
+            log.info('Error importing RPi.GPIO library. Simulating GPIO/Fishdish headless.')
+        elif not _rpi:
+            log.info('Error importing RPi.GPIO library. Simulating GPIO/Fishdish for Windows.')
+
+        if args.audio == 'piezo':
+            _piezo = True
+        elif args.audio == 'pcm':
+            import pcm
+            if not _low_memory and pcm.available():
+                _piezo = False
+            elif _piezo:
+                log.warning('PCM audio needs NumPy and aplay, and is off in low-memory mode: using the piezo')
+
+        if args.start_song:
+            startSong = choosesong(args.start_song, chargeRingtone, piezo=_piezo)
+        else:
+            startSong = loadsong(chargeRingtone, piezo=_piezo)
+        if args.end_song:
+            endSong = choosesong(args.end_song, smdRingtone, piezo=_piezo)
+        else:
+            endSong = loadsong(smdRingtone, piezo=_piezo)
+        if _low_memory:
+            _library = None     # reopened from its index file if the control socket plays a song by name
+        trace('songs')
 
         startSong.play()
 
+        import button
+        _button = button.ButtonHold(GPIO, BUTTON, _loop or eventloop.shared_loop(), hold_time=args.hold_time,
+                                    sample_interval=1.0 / args.sample_rate, on_hold=halt_requested,
+                                    on_release=button_released, on_edge=EDGE_LATENCY.observe)
         GPIO.setup(BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.add_event_detect(BUTTON, GPIO.RISING, callback=shutdown)
+        GPIO.add_event_detect(BUTTON, GPIO.BOTH, callback=shutdown)
+        if _headless and args.sim_press is not None:
+            fd.hold_button(args.hold_time + 1.0, delay=args.sim_press)
+        trace('button')
+        STARTUP.set(_startup[-1][1] - _startup[0][1])
+        if args.metrics_file:
+            metrics_file = args.metrics_file
+            eventloop.shared_loop().call_every(args.metrics_interval, metrics.write_textfile, metrics_file,
+                                               name='metrics')
+        if args.metrics_port:
+            metrics_server = metrics.serve(args.metrics_port)
+        if args.control:
+            import control
+            loaded = {startSong.title: startSong, endSong.title: endSong}
+            control_server = control.Server(args.control, songs().loop, control_commands(loaded))
+            control_server.start()
+        if args.startup_trace:
+            report = startup_report()
+            print(report)
+            log.info(report.replace('\n', '; '))
         # TODO: create virtual FishDish GUI event handler for PC testing/demo in simGPIO.py
 
-        while not _shutdown:
-            pass
+        signal.signal(signal.SIGTERM, on_signal)
+        signal.signal(signal.SIGINT, on_signal)
+
+        while not _shutdown and _interrupted is None:
+            idle_wait()
 
-        SD_CMD = 'sudo shutdown -h now'
+        if _interrupted is not None:
+            msg = 'Fishdish program halted by signal ' + str(_interrupted) + '.'
+            print(msg)
+            log.info(msg)
+            return
+
+        # the halt stage wakes this thread right after starting the halt, before its own timing is recorded
+        _halt.wait(1.0)
+        report = _halt.report()
+        log.info('Shutdown stages: ' + report.replace('\n', '; '))
         if _debug:
+            print(report)
+            print('Button to halt: ' + str(round(BUTTON_TO_HALT.value * 1000, 1)) + 'ms')
             if fd is not None:
                 fd.cleanup()
-            sys.exit('Virtual shutdown (' + SD_CMD + ')\n')
-        elif _rpi:
-            os.system(SD_CMD)
+            sys.exit('Virtual shutdown (' + ' '.join(HALT_COMMAND) + ')\n')
 
     except KeyboardInterrupt:
         msg = 'Fishdish program halted by keyboard interrupt.'
@@ -470,14 +1063,41 @@ def main():
         log.info(msg)
 
     except Exception, e:
-        log.error('Error: ' + str(e))
+        if log is not None:
+            log.error('Error: ' + str(e))
+        else:
+            print('Error: ' + str(e))
 
     finally:
+        if control_server is not None:
+            control_server.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if metrics_file is not None:
+            try:
+                metrics.write_textfile(metrics_file)
+            except (IOError, OSError) as e:
+                log.warning('Unable to write metrics: ' + str(e))
+        if _loop is not None:
+            _loop.stop()
+            _loop = None
+        _leds = None
+        _buzzer = None
+        _halt = None
         GPIO.cleanup()
         if not _rpi and GPIO is not None:
             GPIO = None
+        if _log_writer is not None:
+            _log_writer.stop()
+            _log_writer = None
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['validate']:
+        import validate
+        sys.exit(validate.main(sys.argv[2:], Song.tones))
+    if sys.argv[1:2] == ['memory']:
+        import memreport
+        sys.exit(memreport.main(sys.argv[2:]))
     _debug = True     # uncomment for PC testing
     main()
@@ -0,0 +1,126 @@
+"""
+    Staged shutdown pipeline
+    The shutdown sequence is a set of named stages, each started on an event loop as soon as the stages it
+    depends on have finished, so independent stages (e.g. the end song and the countdown) run in parallel.
+    Every stage is timed from a common origin, normally the moment the button was pressed.
+"""
+
+import threading
+import types
+import clock
+
+
+class Stage(object):
+    """One step of a shutdown Pipeline.
+
+    :param name: stage name, used in the dependencies, timings and log
+    :param action: called on the loop when the stage starts; returns None when it is already done, a coroutine
+                   yielding monotonic deadlines to run as a task, or an object with add_done_callback(callback)
+                   (e.g. a buzzer.Request) that completes it
+    :param after: names of the stages that must finish first
+    """
+
+    def __init__(self, name, action, after=()):
+        self.name = name
+        self.action = action
+        self.after = tuple(after)
+
+
+class Pipeline(object):
+    """Runs shutdown stages on an event loop in dependency order.
+
+    :param loop: eventloop.EventLoop the stages run on
+    :param stages: list of Stage, dependencies on stages not in the list are ignored
+    :param origin: monotonic time the timings are measured from, default the start of the pipeline
+    :param on_stage: called as on_stage(name, started, finished) on the loop as each stage finishes, times in
+                     seconds from origin
+    """
+
+    def __init__(self, loop, stages, origin=None, on_stage=None):
+        self.loop = loop
+        self.stages = list(stages)
+        self.origin = origin
+        self.on_stage = on_stage
+        names = set(stage.name for stage in self.stages)
+        self.pending = dict((stage.name, set(stage.after) & names) for stage in self.stages)
+        self.timings = {}   # (started, finished) by stage name, seconds from origin (loop thread only)
+        self.errors = {}    # exception by stage name
+        self.finished = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def start(self):
+        """Starts the stages that depend on nothing (thread-safe)"""
+        self.loop.call_soon_threadsafe(self._start)
+        return self
+
+    def wait(self, timeout=None):
+        """Blocks until every stage has finished; never call it on the loop thread.
+
+        :return: True if finished
+        """
+        return self.finished.wait(timeout)
+
+    def _start(self):
+        if self.origin is None:
+            self.origin = clock.monotonic()
+        self._advance()
+
+    def _advance(self):
+        ready = [stage for stage in self.stages if stage.name in self.pending and not self.pending[stage.name]]
+        for stage in ready:
+            del self.pending[stage.name]
+        for stage in ready:
+            self._run(stage)
+        if not self.pending and not self.done and \
+                all(finished is not None for _, finished in self.timings.values()):
+            self.finished.set()
+
+    def _run(self, stage):
+        started = clock.monotonic() - self.origin
+        self.timings[stage.name] = (started, None)
+        try:
+            result = stage.action()
+        except Exception as e:
+            self.errors[stage.name] = e
+            result = None
+        if result is None:
+            self._finish(stage)
+        elif isinstance(result, types.GeneratorType):
+            self.loop.spawn(self._task(stage, result), name='halt-' + stage.name)
+        else:
+            # the callback may come from another thread
+            result.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self._finish, stage))
+
+    def _task(self, stage, coroutine):
+        try:
+            for deadline in coroutine:
+                yield deadline
+        except Exception as e:
+            self.errors[stage.name] = e
+        finally:
+            self._finish(stage)
+
+    def _finish(self, stage):
+        started = self.timings[stage.name][0]
+        finished = clock.monotonic() - self.origin
+        self.timings[stage.name] = (started, finished)
+        if self.on_stage is not None:
+            self.on_stage(stage.name, started, finished)
+        for waiting in self.pending.values():
+            waiting.discard(stage.name)
+        self._advance()
+
+    def report(self):
+        """Formats the stages in start order with their duration and the time they ended (loop thread or done)"""
+        lines = []
+        for name, (started, finished) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            if finished is None:
+                lines.append(name + ': running since ' + str(round(started * 1000, 1)) + 'ms')
+                continue
+            lines.append(name + ': ' + str(round((finished - started) * 1000, 1)) + 'ms (at ' +
+                         str(round(finished * 1000, 1)) + 'ms)' +
+                         (' failed: ' + str(self.errors[name]) if name in self.errors else ''))
+        return '\n'.join(lines)
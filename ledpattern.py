@@ -0,0 +1,204 @@
+"""
+    Declarative LED patterns
+    A pattern is compiled into a timeline of (offset, led, level) transitions that is repeated every period.
+    The Scheduler plays any number of patterns as tasks on one event loop, so concurrent effects share a single
+    thread and every edge is placed at an absolute deadline from the start of the pattern.
+
+    Each LED has a base level, OFF unless set. While patterns are active on a LED the most recently started one
+    drives it, and when the last of them finishes or is cancelled the LED returns to its base level.
+"""
+
+import math
+import threading
+import clock
+
+OFF = 0
+ON = 100    # levels are duty cycles in percent
+PWM_FREQUENCY = 200
+MIN_SPACING = 0.001     # shortest average time between transitions, in seconds
+
+
+class Pattern(object):
+    """A compiled LED timeline.
+
+    :param transitions: (offset, led, level) tuples, offsets in seconds from the start of a cycle
+    :param period: cycle length in seconds
+    :param cycles: how many times the timeline is played, 0 repeats it until cancelled
+    :param name: task name for the event loop
+    :raises ValueError: if the period is not finite or leaves less than MIN_SPACING per transition
+    """
+
+    def __init__(self, transitions, period, cycles=1, name='pattern'):
+        transitions = sorted(transitions, key=lambda transition: transition[0])
+        if not MIN_SPACING * max(1, len(transitions)) <= period < float('inf'):
+            raise ValueError('pattern period must be at least ' + str(MIN_SPACING) + 's per transition, not ' +
+                             str(period) + 's for ' + str(len(transitions)))
+        self.transitions = transitions
+        self.period = float(period)
+        self.cycles = int(cycles)
+        self.name = name
+        self.leds = sorted(set(led for _, led, _ in self.transitions))
+        # any level between OFF and ON needs PWM, which then drives every level of the pattern
+        self.pwm = any(OFF < level < ON for _, _, level in self.transitions)
+
+    @property
+    def duration(self):
+        """Seconds the pattern plays for, None if it repeats until cancelled"""
+        if self.cycles == 0:
+            return None
+        return self.period * self.cycles
+
+
+def blink(led, frequency=1.0, cycles=1):
+    """On for the first half of each frequency seconds (the period, as in flashled); cycles=0 blinks forever"""
+    return Pattern([(0.0, led, ON), (frequency / 2.0, led, OFF)], frequency, cycles, 'blink')
+
+
+def heartbeat(led, period=1.2, beat=0.1, cycles=0):
+    """Two short flashes every period"""
+    return Pattern([(0.0, led, ON), (beat, led, OFF), (2 * beat, led, ON), (3 * beat, led, OFF)],
+                   period, cycles, 'heartbeat')
+
+
+def countdown(led, seconds=5):
+    """One half-second flash per second remaining"""
+    transitions = []
+    for tick in range(int(seconds)):
+        transitions.append((float(tick), led, ON))
+        transitions.append((tick + 0.5, led, OFF))
+    return Pattern(transitions, int(seconds), 1, 'countdown')
+
+
+def breathe(led, period=3.0, steps=30, cycles=0):
+    """Fades the LED in and out with PWM, in steps duty cycle changes per period"""
+    transitions = [(period * step / steps, led, round(ON * math.sin(math.pi * step / steps) ** 2, 1))
+                   for step in range(steps)]
+    return Pattern(transitions, period, cycles, 'breathe')
+
+
+class Playback(object):
+    """A pattern being played by a Scheduler"""
+
+    def __init__(self, scheduler, pattern):
+        self.scheduler = scheduler
+        self.pattern = pattern
+        self.levels = {}    # level last set on each LED
+        self.task = None
+        self.finished = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def cancel(self):
+        """Stops the pattern and hands its LEDs back (thread-safe)"""
+        self.task.cancel()
+
+    def wait(self, timeout=None):
+        """Blocks until the pattern has finished or was cancelled; never call it on the scheduler's loop thread.
+
+        :return: True if finished
+        """
+        return self.finished.wait(timeout)
+
+    def _run(self, start):
+        pattern = self.pattern
+        scheduler = self.scheduler
+        scheduler._acquire(self)
+        try:
+            if start is None:
+                start = clock.monotonic()
+            cycle = 0
+            while pattern.cycles == 0 or cycle < pattern.cycles:
+                # skip cycles that are already over, like the missed ticks of a timer, rather than replay them
+                cycle = max(cycle, int((clock.monotonic() - start) // pattern.period))
+                if pattern.cycles and cycle >= pattern.cycles:
+                    break
+                base = start + cycle * pattern.period
+                for offset, led, level in pattern.transitions:
+                    yield base + offset
+                    self.levels[led] = level
+                    scheduler._apply(self, led, level)
+                cycle += 1
+            yield start + cycle * pattern.period
+        finally:
+            scheduler._release(self)
+            self.finished.set()
+
+
+class Scheduler(object):
+    """Plays LED patterns on an event loop, merging them per LED"""
+
+    def __init__(self, GPIO, loop):
+        self.GPIO = GPIO
+        self.loop = loop
+        self.owners = {}    # active playbacks by LED, most recent last (loop thread only)
+        self.base = {}      # base level by LED
+        self.channels = {}  # running PWM channel by LED
+
+    def play(self, pattern, start=None):
+        """Starts a pattern (thread-safe).
+
+        :param start: monotonic time the timeline starts at, default now
+        :return: Playback that can be waited for or cancelled
+        """
+        playback = Playback(self, pattern)
+        playback.task = self.loop.spawn(playback._run(start), name=pattern.name)
+        return playback
+
+    def set(self, led, level):
+        """Sets the base level of a LED, shown at once unless a pattern is active on it (loop thread only)"""
+        self.base[led] = level
+        if not self.owners.get(led):
+            self._output(led, level, False)
+
+    def level(self, led):
+        """Returns the level a LED is showing (loop thread only)"""
+        owners = self.owners.get(led)
+        if owners:
+            return owners[-1].levels.get(led, self.base.get(led, OFF))
+        return self.base.get(led, OFF)
+
+    def cancel(self, led=None):
+        """Cancels every pattern, or those active on one LED (thread-safe)"""
+        def _cancel():
+            for owner, playbacks in self.owners.items():
+                if led is None or owner == led:
+                    for playback in playbacks:
+                        playback.cancel()
+        self.loop.call_soon_threadsafe(_cancel)
+
+    def _acquire(self, playback):
+        for led in playback.pattern.leds:
+            self.owners.setdefault(led, []).append(playback)
+
+    def _apply(self, playback, led, level):
+        if self.owners[led][-1] is playback:
+            self._output(led, level, playback.pattern.pwm)
+
+    def _release(self, playback):
+        for led in playback.pattern.leds:
+            owners = self.owners[led]
+            driving = owners[-1] is playback
+            owners.remove(playback)
+            if not driving:
+                continue
+            if owners:
+                below = owners[-1]
+                self._output(led, below.levels.get(led, self.base.get(led, OFF)), below.pattern.pwm)
+            else:
+                self._output(led, self.base.get(led, OFF), False)
+
+    def _output(self, led, level, pwm):
+        channel = self.channels.get(led)
+        if pwm:
+            if channel is None:
+                channel = self.channels[led] = self.GPIO.PWM(led, PWM_FREQUENCY)
+                channel.start(level)
+            else:
+                channel.ChangeDutyCycle(level)
+            return
+        if channel is not None:
+            channel.stop()
+            del self.channels[led]
+        self.GPIO.output(led, self.GPIO.HIGH if level >= ON / 2.0 else self.GPIO.LOW)
@@ -0,0 +1,229 @@
+"""
+    Persistent ringtone library index
+    Scans a directory tree of RTTL files once and keeps an index of every ringtone in it: title, file and
+    character range, note count, playing time, pitch range and content hash. The index is stored as JSON next
+    to the directory and is only loaded when first queried. Opening it costs one stat() per directory, which
+    detects added and removed files, and one per indexed file, which detects files edited in place; files are
+    parsed again only when their modification time or size changed.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import rttl
+
+EXTENSION = '.rttl'
+INDEX_SUFFIX = '.library.json'
+VERSION = 1
+
+
+class Library(object):
+    """Index of the ringtones under a directory.
+
+    :param directory: directory tree of RTTL files
+    :param tones: pitch in Hz by note name (e.g. fishdish.Song.tones), for playing times and pitch ranges
+    :param path: index file, by default the directory name with INDEX_SUFFIX, kept outside the directory so
+                 that writing it does not change the directory's modification time
+    """
+
+    def __init__(self, directory, tones, path=None):
+        self.directory = directory
+        self.tones = tones
+        self.path = path or directory.rstrip('/\\') + INDEX_SUFFIX
+        self.files = None   # by path relative to the directory: mtime, size and the list of its ringtones
+        self.directories = {}   # modification time by directory when last scanned
+        self.titles = None  # ringtone entry by title
+
+    def _open(self):
+        if self.files is not None:
+            return
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index.get('version') != VERSION:
+                raise ValueError('old index')
+            files = index['files']
+            directories = index['directories']
+        except (IOError, OSError, ValueError, KeyError):
+            self.files = {}
+            self.update()
+            return
+        self.files = files
+        self.directories = directories
+        if self._stale():
+            self.update()   # only the files that changed are parsed again
+            return
+        self._titles()
+
+    def _stale(self):
+        try:
+            # adding, removing or renaming a file changes the modification time of its directory,
+            # editing a file in place only its own
+            for directory, mtime in self.directories.items():
+                if os.stat(os.path.join(self.directory, directory)).st_mtime != mtime:
+                    return True
+            for name, known in self.files.items():
+                stat = os.stat(os.path.join(self.directory, name))
+                if stat.st_mtime != known['mtime'] or stat.st_size != known['size']:
+                    return True
+        except OSError:
+            return True
+        return False
+
+    def _titles(self):
+        self.titles = {}
+        for name in sorted(self.files):
+            for entry in self.files[name]['ringtones']:
+                self.titles.setdefault(entry['title'], entry)
+
+    def _index(self, name):
+        """Parses one file into ringtone entries"""
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            text = f.read()
+        entries = []
+        for start, end, title, tempo, notes in rttl.scan(text):
+            beat = 108.0 / tempo
+            pitches = [self.tones.get(note, 0) for note, _ in notes]
+            audible = [pitch for pitch in pitches if pitch > 0]
+            entries.append({
+                'title': title,
+                'file': name,
+                'offset': start,
+                'length': end - start,
+                'tempo': tempo,
+                'notes': len(notes),
+                'duration': round(sum(beat / divisor * 1.3 for _, divisor in notes), 3),
+                'min_frequency': min(audible) if audible else 0,
+                'max_frequency': max(audible) if audible else 0,
+                'hash': hashlib.sha1(text[start:end]).hexdigest(),
+            })
+        return entries
+
+    def update(self):
+        """Re-indexes the files that were added or changed since the last update and saves the index.
+
+        Files that cannot be parsed are left out of the index.
+        :return: number of files parsed
+        """
+        if self.files is None:
+            self._open()
+        found = {}
+        directories = {}
+        for directory, _, names in os.walk(self.directory):
+            directories[os.path.relpath(directory, self.directory)] = os.stat(directory).st_mtime
+            for name in names:
+                if name.lower().endswith(EXTENSION):
+                    path = os.path.join(directory, name)
+                    found[os.path.relpath(path, self.directory)] = os.stat(path)
+        parsed = 0
+        files = {}
+        for name, stat in found.items():
+            known = self.files.get(name)
+            if known is not None and known['mtime'] == stat.st_mtime and known['size'] == stat.st_size:
+                files[name] = known
+                continue
+            try:
+                ringtones = self._index(name)
+            except (rttl.RTTLError, ZeroDivisionError, IOError):
+                ringtones = []
+            files[name] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'ringtones': ringtones}
+            parsed += 1
+        changed = parsed > 0 or len(files) != len(self.files) or directories != self.directories
+        self.files = files
+        self.directories = directories
+        self._titles()
+        if changed or not os.path.exists(self.path):
+            self.save()
+        return parsed
+
+    def save(self):
+        """Writes the index (atomically except on Windows); a read-only directory only loses the persistence"""
+        index = {'version': VERSION, 'directories': self.directories, 'files': self.files}
+        tmp = self.path + '.' + str(os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            if sys.platform.lower().startswith('win32') and os.path.exists(self.path):
+                os.remove(self.path)    # Python 2 cannot rename over an existing file on Windows
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+    def get(self, title):
+        """Returns the entry of a ringtone by title, None if unknown"""
+        self._open()
+        return self.titles.get(title)
+
+    def find(self, min_duration=None, max_duration=None, min_frequency=None, max_frequency=None):
+        """Returns the entries of the ringtones that satisfy every given limit, sorted by title"""
+        self._open()
+        return [entry for title, entry in sorted(self.titles.items())
+                if (min_duration is None or entry['duration'] >= min_duration) and
+                (max_duration is None or entry['duration'] <= max_duration) and
+                (min_frequency is None or entry['min_frequency'] >= min_frequency) and
+                (max_frequency is None or entry['max_frequency'] <= max_frequency)]
+
+    def choose(self, query):
+        """Picks a ringtone by title, or with '<SECONDS' the longest one playing for at most SECONDS.
+
+        :return: entry, None if nothing matches
+        """
+        if query.startswith('<'):
+            fitting = self.find(max_duration=float(query.lstrip('<=')))
+            return max(fitting, key=lambda entry: entry['duration']) if fitting else None
+        return self.get(query)
+
+    def read(self, entry):
+        """Returns the RTTL text of an entry, re-indexing first if its file has changed.
+
+        :raises KeyError: if the ringtone is no longer in its file
+        """
+        path = os.path.join(self.directory, entry['file'])
+        known = self.files.get(entry['file'])
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if known is None or stat is None or known['mtime'] != stat.st_mtime or known['size'] != stat.st_size:
+            self.update()
+            entry = self.get(entry['title'])
+            if entry is None:
+                raise KeyError('ringtone is no longer in the library')
+            path = os.path.join(self.directory, entry['file'])
+        with open(path, 'rb') as f:
+            f.seek(entry['offset'])
+            return f.read(entry['length'])
+
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+    import fishdish
+    # builds the index of a copy of the song directory repeated 200 times, then times a lazy open and query
+    directory = tempfile.mkdtemp()
+    try:
+        for copy in range(200):
+            for name in os.listdir(fishdish.SONG_DIR):
+                if name.endswith(EXTENSION):
+                    shutil.copy(os.path.join(fishdish.SONG_DIR, name), os.path.join(directory, str(copy) + name))
+        start = time.time()
+        Library(directory, fishdish.Song.tones).get('PacMan')
+        built = time.time() - start
+        start = time.time()
+        library = Library(directory, fishdish.Song.tones)
+        entry = library.choose(sys.argv[1] if len(sys.argv) > 1 else '<3')
+        opened = time.time() - start
+        start = time.time()
+        text = library.read(entry)
+        read = time.time() - start
+        print('indexed ' + str(len(library.files)) + ' files in ' + str(round(built * 1000, 1)) + 'ms, opened and '
+              'queried in ' + str(round(opened * 1000, 1)) + 'ms, read ' + entry['title'] + ' in ' +
+              str(round(read * 1e6)) + 'us')
+    finally:
+        shutil.rmtree(directory)
+        try:
+            os.unlink(directory + INDEX_SUFFIX)
+        except OSError:
+            pass
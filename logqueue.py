@@ -0,0 +1,189 @@
+"""
+    Queue-based logging that keeps storage writes off the playback and GPIO threads
+    Python 2 has no logging.handlers.QueueHandler/QueueListener, so this provides both: records are queued by
+    the logging thread and buffered in memory by one writer thread, which only writes them to the real handlers
+    (e.g. a RotatingFileHandler on the SD card) on WARNING or above, when the buffer is full or on a timer.
+"""
+
+import os
+import logging
+import threading
+import Queue
+
+_FLUSH = 'flush'    # queue sentinels
+_STOP = 'stop'
+
+
+class QueueHandler(logging.Handler):
+    """Hands records to a BufferedWriter queue; drops them rather than block when the queue is full"""
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        # render the message and traceback now, so the record holds no references to mutable arguments
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class SizeRotatingFileHandler(logging.FileHandler):
+    """Log file rotated by size like logging.handlers.RotatingFileHandler, for the low-memory mode: importing
+    logging.handlers also loads socket and, on Python 2, OpenSSL"""
+
+    def __init__(self, filename, maxBytes, backupCount):
+        logging.FileHandler.__init__(self, filename, 'a')
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+
+    def emit(self, record):
+        try:
+            if self.stream is not None and self.stream.tell() >= self.maxBytes:
+                self.rollover()
+        except (IOError, OSError):
+            self.handleError(record)
+        logging.FileHandler.emit(self, record)
+
+    def rollover(self):
+        """Closes the file and shifts it to name.1, name.1 to name.2 and so on, dropping the oldest"""
+        self.stream.close()
+        self.stream = None
+        for index in range(self.backupCount - 1, 0, -1):
+            source = self.baseFilename + '.' + str(index)
+            if os.path.exists(source):
+                os.rename(source, self.baseFilename + '.' + str(index + 1))
+        if self.backupCount > 0:
+            os.rename(self.baseFilename, self.baseFilename + '.1')
+        self.stream = self._open()
+
+
+class Sync(object):
+    """A request to write out and sync everything logged before it, completed by the writer thread"""
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Calls callback(sync) once the records are on storage, at once if they already are"""
+        with self._lock:
+            if not self.done:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def _complete(self):
+        with self._lock:
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class BufferedWriter(threading.Thread):
+    """Writes queued records to handlers in batches from a background thread.
+
+    :param handlers: the handlers that do the actual output
+    :param flush_level: a record at this level or above is written at once together with the buffer
+    :param flush_interval: buffered records are written at most this many seconds after they arrive
+    :param capacity: the buffer is written when it holds this many records
+    :param maxsize: queue length above which new records are dropped
+    """
+
+    def __init__(self, handlers, flush_level=logging.WARNING, flush_interval=10.0, capacity=500, maxsize=5000):
+        threading.Thread.__init__(self, name='logwriter')
+        self.setDaemon(True)
+        self.handlers = handlers
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.queue = Queue.Queue(maxsize)
+        self.buffer = []
+        self.timer = None
+
+    def run(self):
+        while True:
+            # blocks without polling: the flush timer wakes the thread through the queue
+            item = self.queue.get()
+            if item is _STOP:
+                self.flush()
+                break
+            if item is _FLUSH:
+                self.timer = None
+                self.flush()
+                continue
+            if isinstance(item, Sync):
+                self.flush()
+                self._fsync()
+                item._complete()
+                continue
+            self.buffer.append(item)
+            if item.levelno >= self.flush_level or len(self.buffer) >= self.capacity:
+                self.flush()
+            elif self.timer is None:
+                import eventloop
+                self.timer = eventloop.shared_loop().call_later(self.flush_interval, self._request_flush)
+
+    def _request_flush(self):
+        try:
+            self.queue.put_nowait(_FLUSH)
+        except Queue.Full:
+            pass    # the writer is busy and will flush on capacity
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for record in self.buffer:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        for handler in self.handlers:
+            handler.flush()
+        self.buffer = []
+
+    def _fsync(self):
+        for handler in self.handlers:
+            stream = getattr(handler, 'stream', None)
+            if stream is not None:
+                try:
+                    os.fsync(stream.fileno())
+                except (AttributeError, ValueError, OSError):
+                    pass
+
+    def sync(self):
+        """Asks the writer thread to write the records queued so far and fsync them (thread-safe).
+
+        :return: Sync that completes once they are on storage
+        """
+        sync = Sync()
+        self.queue.put(sync)
+        return sync
+
+    def stop(self):
+        """Writes everything still queued or buffered and stops the writer thread"""
+        self.queue.put(_STOP)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
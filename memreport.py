@@ -0,0 +1,221 @@
+"""
+    Memory footprint report by subsystem
+    Starts the fishdish subsystems one at a time in a fresh interpreter, the way main() does, and records the
+    resident set size, its peak, the live threads and the number of objects tracked by the garbage collector
+    after each one. Python 2 has no tracemalloc, so the figures come from /proc/self/status (VmRSS and VmHWM),
+    with getrusage() for the peak elsewhere; when tracemalloc is available the traced Python allocations and
+    their peak are reported as well. The report is JSON so that footprints can be compared across releases.
+
+    usage: fishdish.py memory [--low-memory] [--json] [--output FILE]
+"""
+
+import os
+import gc
+import sys
+import json
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def usage():
+    """Returns (rss, peak) of this process in KiB, either None where unavailable"""
+    rss = peak = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1])
+    except IOError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss    # KiB on Linux, bytes on macOS
+        except ImportError:
+            pass
+    return rss, peak
+
+
+def measure(name):
+    """Returns the footprint after a stage"""
+    gc.collect()
+    rss, peak = usage()
+    stage = {
+        'stage': name,
+        'rss_kb': rss,
+        'peak_kb': peak,
+        'threads': threading.active_count(),
+        'objects': len(gc.get_objects()),
+    }
+    if tracemalloc is not None:
+        current, traced_peak = tracemalloc.get_traced_memory()
+        stage['traced_kb'] = current // 1024
+        stage['traced_peak_kb'] = traced_peak // 1024
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+    return stage
+
+
+def stages(low_memory, directory):
+    """Yields (name, function) for each subsystem in start-up order, logging to a file in directory"""
+    state = {}
+
+    def board():
+        import fishdish
+        state['fishdish'] = fishdish
+
+    def logging_():
+        import logging
+        import logqueue
+        fishdish = state['fishdish']
+        path = os.path.join(directory, 'fishdish.log')
+        if low_memory:
+            handler = logqueue.SizeRotatingFileHandler(path, maxBytes=5 * 1024 * 1024, backupCount=2)
+            writer = logqueue.BufferedWriter([handler], capacity=fishdish.LOW_MEMORY_LOG_BUFFER,
+                                             maxsize=fishdish.LOW_MEMORY_LOG_QUEUE)
+        else:
+            from logging.handlers import RotatingFileHandler
+            handler = RotatingFileHandler(path, maxBytes=5 * 1024 * 1024, backupCount=2)
+            writer = logqueue.BufferedWriter([handler])
+        writer.start()
+        fishdish._log_writer = writer
+        fishdish.log = logging.getLogger('memreport')
+        fishdish.log.setLevel(logging.INFO)
+        fishdish.log.addHandler(logqueue.QueueHandler(writer.queue))
+
+    def loop():
+        import eventloop
+        fishdish = state['fishdish']
+        if low_memory:
+            fishdish._loop = eventloop.shared_loop()
+        else:
+            fishdish._loop = eventloop.EventLoop()
+            fishdish._loop.start()
+            eventloop.shared_loop()
+
+    def songs():
+        fishdish = state['fishdish']
+        state['start'] = fishdish.loadsong(fishdish.chargeRingtone, piezo=fishdish._piezo)
+        state['end'] = fishdish.loadsong(fishdish.smdRingtone, piezo=fishdish._piezo)
+
+    def leds():
+        import ledpattern
+        fishdish = state['fishdish']
+        fishdish.leds().play(ledpattern.blink(fishdish.LED_GRN, 0.1, 2)).wait()
+
+    def buzzer():
+        state['start'].play().wait()
+
+    def button():
+        import button
+        fishdish = state['fishdish']
+        fishdish._button = button.ButtonHold(fishdish.GPIO, fishdish.BUTTON, fishdish._loop,
+                                             on_hold=fishdish.halt_requested)
+        fishdish.GPIO.setup(fishdish.BUTTON, fishdish.GPIO.IN, pull_up_down=fishdish.GPIO.PUD_DOWN)
+        fishdish.GPIO.add_event_detect(fishdish.BUTTON, fishdish.GPIO.BOTH, callback=fishdish.shutdown)
+
+    def library():
+        fishdish = state['fishdish']
+        fishdish.library().find()
+        if low_memory:
+            fishdish._library = None    # released after the start-up songs are chosen, as in main()
+
+    def pcm():
+        import pcm
+
+    yield 'board', board
+    yield 'logging', logging_
+    yield 'eventloop', loop
+    yield 'songs', songs
+    yield 'leds', leds
+    yield 'buzzer', buzzer
+    yield 'button', button
+    yield 'library', library
+    if not low_memory:
+        yield 'pcm', pcm
+
+
+def worker(low_memory, directory):
+    """Measures every stage in this process and writes the list of footprints to stdout as JSON"""
+    if tracemalloc is not None:
+        tracemalloc.start()
+    results = [measure('interpreter')]
+    for name, function in stages(low_memory, directory):
+        function()
+        results.append(measure(name))
+    sys.stdout.write(json.dumps(results) + '\n')
+
+
+def report(low_memory=False):
+    """Runs the stages in a fresh interpreter.
+
+    :return: the report as a dictionary
+    """
+    import shutil
+    import platform
+    import tempfile
+    import subprocess
+    from benchmark import revision
+    directory = tempfile.mkdtemp()
+    command = [sys.executable, os.path.abspath(__file__), '--worker', directory]
+    if low_memory:
+        command.append('--low-memory')     # seen by fishdish at import, before it picks the simulator
+    try:
+        output = subprocess.check_output(command)
+    finally:
+        shutil.rmtree(directory)
+    results = json.loads(output.strip().splitlines()[-1])
+    for previous, stage in zip(results, results[1:]):
+        for key in ('rss_kb', 'peak_kb', 'traced_kb'):
+            if stage.get(key) is not None and previous.get(key) is not None:
+                stage[key.replace('_kb', '_delta_kb')] = stage[key] - previous[key]
+    return {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'low_memory': low_memory,
+        'stages': results,
+    }
+
+
+def table(result):
+    """Formats a report as a text table"""
+    columns = ['stage', 'rss_kb', 'rss_delta_kb', 'peak_kb', 'peak_delta_kb', 'threads', 'objects']
+    if any('traced_kb' in stage for stage in result['stages']):
+        columns += ['traced_kb', 'traced_peak_kb']
+    rows = [columns] + [[str(stage.get(column, '')) for column in columns] for stage in result['stages']]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in
+                               enumerate(zip(row, widths))) for row in rows)
+
+
+def main(argv):
+    """Command line entry point, see the module usage"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='fishdish.py memory', description='Report the memory used by subsystem')
+    parser.add_argument('--low-memory', action='store_true', help='measure the --low-memory configuration')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON instead of a table')
+    parser.add_argument('-o', '--output', help='write the JSON report to a file')
+    args = parser.parse_args(argv)
+    result = report(args.low_memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        print(table(result))
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--worker']:
+        worker('--low-memory' in sys.argv[3:], sys.argv[2])
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,144 @@
+"""
+    Renders songs to PCM audio with NumPy so that a whole song is played with one buffered write
+    instead of one blocking call per note
+
+    Rendered songs are cached in memory and as WAV files in the temp directory, keyed by a hash of the song,
+    and played asynchronously with winsound on Windows or aplay on Linux.
+"""
+
+import os
+import sys
+import wave
+import struct
+import hashlib
+import tempfile
+import subprocess
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SAMPLE_RATE = 22050
+VOLUME = 0.3        # fraction of full scale
+ARTICULATION = 0.3  # silent gap after each note, as a fraction of its duration
+
+_rendered = {}      # samples by (song hash, waveform, rate)
+
+
+def songkey(tempo, frequencies, durations):
+    """Returns a hex digest identifying a song's tempo, frequencies and duration divisors"""
+    h = hashlib.sha1(struct.pack('<HH', int(tempo), len(frequencies)))
+    h.update(struct.pack('<%dd' % len(frequencies), *frequencies))
+    h.update(struct.pack('<%dH' % len(durations), *durations))
+    return h.hexdigest()
+
+
+def render(tempo, frequencies, durations, waveform='square', rate=SAMPLE_RATE):
+    """Renders a song to 16 bit mono samples, including the articulation gap after each note.
+
+    :param tempo: beats per minute
+    :param frequencies: note pitches in Hz (0 for a pause)
+    :param durations: note duration divisors
+    :param waveform: 'square' (like the piezo) or 'sine'
+    :param rate: samples per second
+    :return: numpy int16 array, shared with the render cache
+    """
+    if numpy is None:
+        raise RuntimeError('NumPy is required to render songs')
+    key = (songkey(tempo, frequencies, durations), waveform, rate)
+    samples = _rendered.get(key)
+    if samples is not None:
+        return samples
+    freqs = numpy.asarray(frequencies, dtype=numpy.float64)
+    seconds = (108.0 / float(tempo)) / numpy.asarray(durations, dtype=numpy.float64)
+    # segment edges alternate note start, note end: rounding edges rather than lengths avoids drift
+    starts = numpy.concatenate(([0.0], numpy.cumsum(seconds * (1 + ARTICULATION))))
+    edges = numpy.empty(2 * len(freqs) + 1)
+    edges[0::2] = starts
+    edges[1::2] = starts[:-1] + seconds
+    lengths = numpy.diff(numpy.rint(edges * rate).astype(numpy.int64))
+    segment_freqs = numpy.zeros(2 * len(freqs))
+    segment_freqs[0::2] = freqs
+    per_sample = numpy.repeat(segment_freqs, lengths)
+    phase = numpy.cumsum(per_sample) * (2 * numpy.pi / rate)
+    audio = numpy.sin(phase)
+    if waveform == 'square':
+        audio = numpy.sign(audio)
+    elif waveform != 'sine':
+        raise ValueError('Unknown waveform ' + str(waveform))
+    audio *= per_sample > 0
+    samples = (audio * (VOLUME * 32767)).astype(numpy.int16)
+    _rendered[key] = samples
+    return samples
+
+
+def export(samples, target, rate=SAMPLE_RATE):
+    """Writes samples to a WAV file name or file object"""
+    out = wave.open(target, 'wb')
+    try:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        data = samples.astype('<i2')
+        out.writeframes(data.tostring())
+    finally:
+        out.close()
+
+
+def wavfile(tempo, frequencies, durations, waveform='square', rate=SAMPLE_RATE):
+    """Returns the cached WAV file of a song (see render), rendering and writing it the first time"""
+    key = songkey(tempo, frequencies, durations)
+    path = os.path.join(tempfile.gettempdir(), 'fishdish-' + key + '-' + waveform + '-' + str(rate) + '.wav')
+    if not os.path.exists(path):
+        tmp = path + '.' + str(os.getpid())
+        export(render(tempo, frequencies, durations, waveform, rate), tmp, rate)
+        os.rename(tmp, path)
+    return path
+
+
+_playing_out = []     # detached Players whose process has not been reaped yet
+
+
+def available():
+    """Returns True if songs can be rendered and played here: NumPy, and winsound or aplay on the PATH"""
+    if numpy is None:
+        return False
+    if sys.platform.lower().startswith('win32'):
+        return True
+    return any(os.access(os.path.join(directory, 'aplay'), os.X_OK)
+               for directory in os.environ.get('PATH', os.defpath).split(os.pathsep))
+
+
+class Player(object):
+    """Plays a WAV file asynchronously"""
+
+    def __init__(self, path):
+        self.process = None
+        _reap()
+        if sys.platform.lower().startswith('win32'):
+            import winsound
+            winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+        else:
+            with open(os.devnull, 'w') as devnull:
+                self.process = subprocess.Popen(['aplay', '-q', path], stdout=devnull, stderr=devnull)
+
+    def detach(self):
+        """Lets the sound play out; its process is reaped once it has exited, when the next Player starts"""
+        if self.process is not None:
+            _playing_out.append(self)
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        elif sys.platform.lower().startswith('win32'):
+            import winsound
+            winsound.PlaySound(None, 0)
+
+
+def _reap():
+    for player in list(_playing_out):
+        if player.process.poll() is not None:
+            _playing_out.remove(player)
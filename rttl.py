@@ -0,0 +1,214 @@
+"""
+    Single-pass RTTL tokenizer
+
+    Ringtone format: https://en.wikipedia.org/wiki/Ring_Tone_Transfer_Language
+        <title>:d=<duration>,o=<octave>,b=<bpm>:<note>,<note>,...
+        note: [duration]<a-g|p>[#][.][octave][.]
+    Whitespace is allowed around separators and the dot may come before or after the octave.
+
+    parse() reads a whole ringtone at once; stream() reads ringtones incrementally from a string or file,
+    one after the other, so that a note can be used as soon as it has been read.
+"""
+
+import re
+from StringIO import StringIO
+
+DEFAULT_DURATION = 4
+DEFAULT_OCTAVE = 6
+DEFAULT_TEMPO = 63
+MAX_DURATION = 0xFFFF   # the song cache stores durations and the tempo as uint16
+MAX_TEMPO = 0xFFFF
+CHUNK_SIZE = 4096
+
+_header = re.compile(r'\s*([^:]*?)\s*:([^:]*):')
+_default = re.compile(r'\s*([dobDOB])\s*=\s*(\d+)\s*(?:,|$)')
+_note = re.compile(r'\s*(\d+)?([a-gA-GpP])(#)?(\.)?(\d)?(\.)?\s*(?:,|$)')
+# in a stream a ringtone ends at the first note that is not followed by a comma
+_stream_note = re.compile(r'\s*(\d+)?([a-gA-GpP])(#)?(\.)?(\d)?(\.)?[ \t\r]*(,|\n|$)')
+_field = re.compile(r'\s*[^\s,][^,\n]*[,\n]')    # a complete note in a stream
+
+
+class RTTLError(ValueError):
+    """Raised when a ringtone does not follow the RTTL format"""
+
+    def __init__(self, message, ringtone, position, offset=0):
+        """:param offset: position of ringtone[0] in the whole text, when ringtone is a window of a stream"""
+        self.position = offset + position
+        snippet = ringtone[position:position + 10].split('\n')[0]
+        ValueError.__init__(self, message + ' at position ' + str(self.position) + " near '" + snippet + "'")
+
+
+def _defaults(ringtone, pos, end, offset=0):
+    defaults = {'d': DEFAULT_DURATION, 'o': DEFAULT_OCTAVE, 'b': DEFAULT_TEMPO}
+    while pos < end:
+        match = _default.match(ringtone, pos, end)
+        if match is None:
+            if not ringtone[pos:end].strip():
+                break
+            raise RTTLError('Invalid default, expected d=, o= or b=', ringtone, pos, offset)
+        key = match.group(1).lower()
+        value = int(match.group(2))
+        if key == 'd' and not 0 < value <= MAX_DURATION:
+            raise RTTLError('Default duration must be 1 to ' + str(MAX_DURATION), ringtone, match.start(2), offset)
+        if key == 'b' and not 0 < value <= MAX_TEMPO:
+            raise RTTLError('Tempo must be 1 to ' + str(MAX_TEMPO), ringtone, match.start(2), offset)
+        defaults[key] = value
+        pos = match.end()
+    return defaults
+
+
+def _convert(match, default_duration, default_octave, offset=0):
+    duration, letter, sharp, dot1, octave, dot2 = match.group(1, 2, 3, 4, 5, 6)
+    if duration:
+        duration = int(duration)
+        if not 0 < duration <= MAX_DURATION:
+            raise RTTLError('Duration must be 1 to ' + str(MAX_DURATION), match.string, match.start(1), offset)
+    else:
+        duration = default_duration
+    if dot1 or dot2:
+        # a dotted whole note is the longest a divisor can express
+        duration = max(1, int(1.0 / (1.0 / float(duration) * 1.5)))
+    note = letter.upper()
+    if note != 'P':
+        if sharp:
+            note += '#'
+        note += octave or default_octave
+    return note, duration
+
+
+def parse(ringtone):
+    """Parses a RTTL ringtone in one pass over the text.
+
+    :param ringtone: an RTTL compliant text string
+    :return: (title, tempo, notes, durations) with note names such as 'C#5' or 'P' and duration divisors
+    :raises RTTLError: with the position of the first invalid character
+    """
+    header = _header.match(ringtone)
+    if header is None:
+        raise RTTLError('Expected <title>:<defaults>:', ringtone, 0)
+    title = header.group(1)
+    defaults = _defaults(ringtone, header.start(2), header.end(2))
+    default_duration = defaults['d']
+    default_octave = str(defaults['o'])
+    notes = []
+    durations = []
+    pos = header.end()
+    end = len(ringtone.rstrip())
+    while pos < end:
+        match = _note.match(ringtone, pos, end)
+        if match is None:
+            raise RTTLError('Invalid note', ringtone, pos)
+        note, duration = _convert(match, default_duration, default_octave)
+        notes.append(note)
+        durations.append(duration)
+        pos = match.end()
+    return title, defaults['b'], notes, durations
+
+
+def parse_many(ringtones):
+    """Parses an iterable of RTTL ringtones.
+
+    :return: list of (title, tempo, notes, durations) in the same order
+    """
+    return [parse(ringtone) for ringtone in ringtones]
+
+
+class _Window(object):
+    """The unread part of a text stream, read in chunks as far as the next separator"""
+
+    def __init__(self, source, chunk_size):
+        self.read = source.read if hasattr(source, 'read') else StringIO(source).read
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.offset = 0     # stream position of text[0]
+        self.eof = False
+
+    def fill(self, found):
+        """Reads until found(text, pos) is true or the stream ends"""
+        while not self.eof and not found(self.text, self.pos):
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            # drop what has been read so that memory stays bounded by the longest field
+            self.offset += self.pos
+            self.text = self.text[self.pos:] + chunk
+            self.pos = 0
+
+    def error(self, message):
+        return RTTLError(message, self.text, self.pos, self.offset)
+
+
+def _has_header(text, pos):
+    first = text.find(':', pos)
+    return first >= 0 and text.find(':', first + 1) >= 0
+
+
+def _has_note(text, pos):
+    return _field.match(text, pos) is not None
+
+
+def _has_content(text, pos):
+    return bool(text[pos:].strip())
+
+
+def _stream_notes(window, defaults):
+    default_duration = defaults['d']
+    default_octave = str(defaults['o'])
+    while True:
+        window.fill(_has_note)
+        match = _stream_note.match(window.text, window.pos)
+        if match is None:
+            raise window.error('Invalid note')
+        window.pos = match.end()
+        yield _convert(match, default_duration, default_octave, window.offset)
+        if match.group(7) != ',':
+            return
+
+
+def _ringtones(window):
+    while True:
+        window.fill(_has_content)
+        if not _has_content(window.text, window.pos):
+            return
+        window.fill(_has_header)
+        header = _header.match(window.text, window.pos)
+        if header is None:
+            raise window.error('Expected <title>:<defaults>:')
+        start = window.offset + header.start(1)
+        defaults = _defaults(window.text, header.start(2), header.end(2), window.offset)
+        window.pos = header.end()
+        notes = _stream_notes(window, defaults)
+        yield start, header.group(1), defaults['b'], notes
+        for _ in notes:
+            pass
+
+
+def stream(source, chunk_size=CHUNK_SIZE):
+    """Parses RTTL ringtones incrementally from a string or file object holding one or more ringtones.
+
+    Consecutive ringtones are separated by a line break after the last note; a ringtone may span lines
+    as long as they end with a comma.
+    :param source: RTTL text or a file object to read it from
+    :param chunk_size: characters read at a time
+    :return: generator of (title, tempo, notes) per ringtone, where notes is a generator of (note, duration)
+             that is read from the source as it is consumed, and is skipped if not consumed before the next ringtone
+    :raises RTTLError: with the position in the source of the first invalid character
+    """
+    for _, title, tempo, notes in _ringtones(_Window(source, chunk_size)):
+        yield title, tempo, notes
+
+
+def scan(source, chunk_size=CHUNK_SIZE):
+    """Parses the ringtones of a string or file object like stream(), with where each one is in the source.
+
+    :return: generator of (start, end, title, tempo, notes) per ringtone, with the position of its first and
+             after its last character and the list of its (note, duration)
+    :raises RTTLError: with the position in the source of the first invalid character
+    """
+    window = _Window(source, chunk_size)
+    for start, title, tempo, notes in _ringtones(window):
+        notes = list(notes)
+        yield start, window.offset + window.pos, title, tempo, notes
+
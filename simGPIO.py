@@ -1,59 +1,13 @@
 """
     Simulates the Raspberry Pi GPIO to some degree
     v1.0: spoofs most functions to do nothing
+    Tkinter is only imported when the pin display is opened, so the simulator also runs headless
 """
 
 import sys
 import math
-import Tkinter as tk
 import threading
-
-
-class RepeatingTimer():
-    """ A Timer class that does not stop, unless you want it to.
-     Used to call repeating functions at defined intervals.
-    """
-
-    def __init__(self, seconds, target, args=None, name=''):
-        self._should_continue = False
-        self.is_running = False
-        self.seconds = seconds
-        self.target = target
-        self.args = args
-        self.thread = None
-        if name != '':
-            self.name = name
-
-    def _handle_target(self):
-        self.is_running = True
-        if self.args is not None:
-            self.target(self.args)
-        else:
-            self.target()
-        self.is_running = False
-        self._start_timer()
-
-    def _start_timer(self):
-        if self._should_continue:
-            self.thread = threading.Timer(self.seconds, self._handle_target)
-            # self.thread.setDaemon(True)
-            if self.name != '':
-                self.thread.name = self.name
-            self.thread.start()
-
-    def start(self):
-        if not self._should_continue and not self.is_running:
-            self._should_continue = True
-            self._start_timer()
-        else:
-            print('Timer already started or running, process must wait')
-
-    def cancel(self):
-        if self.thread is not None:
-            self._should_continue = False  # Just in case thread is running and cancel failed
-            self.thread.cancel()
-        else:
-            print('Timer never started or failed to initialize')
+import Queue
 
 
 class GPIO(object):
@@ -111,6 +65,10 @@ class GPIO(object):
         'GPIO21': 40
     }
 
+    # reverse lookups built once from board_map
+    bcm_map = dict((int(key[4:]), val) for key, val in board_map.items() if key.startswith('GPIO'))
+    channel_map = dict((val, key) for key, val in bcm_map.items())
+
     BCM = 1
     BOARD = 0
     # setup config types
@@ -131,6 +89,7 @@ class GPIO(object):
             threading.Thread.__init__(self)
             self.setDaemon(True)
             self.labels = labels
+            import Tkinter as tk
             self.window = tk.Toplevel()
             self.start()
 
@@ -138,6 +97,7 @@ class GPIO(object):
             self.window.quit()
 
         def run(self):
+            import Tkinter as tk
             self.window.protocol("WM_DELETE_WINDOW", self.quit)
             self.window.title('RPi GPIO')
             self.window.geometry('200x450+30+30')
@@ -178,13 +138,18 @@ class GPIO(object):
 
     def __init__(self):
         self.mode = 'BCM'
-        self.config = []
-        self.events = []
-        self.threads = []
-        self.root = tk.Tk()
-        self.root.withdraw()
+        self.config = {}    # pin state by board pin: {"pin", "config", "value"}
+        self.events = {}    # edge detection by board pin: {"pin", "config", "value", "callback"}
+        self.edges = Queue.Queue()  # pending (callback, channel) for the callback thread
+        self.callback_thread = None
+        self.listeners = []     # called with (channel, state) when an output changes
+        self.root = None
 
     def display(self):
+        if self.root is None:
+            import Tkinter as tk
+            self.root = tk.Tk()
+            self.root.withdraw()
         self.Display(self.board_map)
 
     def setmode(self, mode):
@@ -198,82 +163,126 @@ class GPIO(object):
 
     def setup(self, pins, config, initial=None, pull_up_down=None):
         if config == self.OUT:
-            if isinstance(pins, list):
-                for item in pins:
-                    pin = self.getpin(item)
-                    self.config.append({"pin": pin, "config": self.OUT, "value": initial})
-            else:
-                pin = self.getpin(pins)
-                self.config.append({"pin": pin, "config": self.OUT, "value": initial})
+            value = initial
         elif config == self.IN:
-            if isinstance(pins, list):
-                for item in pins:
-                    pin = self.getpin(item)
-                    self.config.append({"pin": pin, "config": self.IN, "value": pull_up_down})
-            else:
-                pin = self.getpin(pins)
-                self.config.append({"pin": pin, "config": self.IN, "value": pull_up_down})
+            value = pull_up_down
         else:
             errMsg = 'Invalid setup. Please use GPIO.setup(channel, GPIO.IN) or GPIO.setup(channel, GPIO.OUT)'
             sys.exit(errMsg)
+        if not isinstance(pins, list):
+            pins = [pins]
+        for item in pins:
+            pin = self.getpin(item)
+            self.config[pin] = {"pin": pin, "config": config, "value": value}
 
     def getpin(self, pinref):
         pin = pinref
         if self.mode == 'BCM':
-            pinname = 'GPIO' + str(pinref)
-            pin = self.board_map[pinname]
+            pin = self.bcm_map[pinref]
         return pin
 
     def getchannel(self, pinref):
-        channel = 99  # unknown
-        for key, val in self.board_map.iteritems():
-            if val == pinref and key.startswith("GPIO"):
-                channel = key.strip("GPIO")
-        return channel
+        if self.mode == 'BCM':
+            return self.channel_map.get(pinref, 99)  # 99: unknown
+        return pinref
 
     def input(self, channel):
-        pin = self.getpin(channel)
-        match = next((l for l in self.config if l['pin'] == pin), None)
+        match = self.config.get(self.getpin(channel))
         if match is not None and match['config'] == self.IN:
             return match['value']
 
+    def set_input(self, channel, value):
+        """Drives a simulated input (e.g. a button) and fires any edge event it triggers"""
+        pin = self.getpin(channel)
+        match = self.config.get(pin)
+        if match is not None and match['config'] == self.IN:
+            match['value'] = value
+            if pin in self.events:
+                self.check_event(pin)
+
     def add_event_detect(self, channel, config, callback):
         pin = self.getpin(channel)
-        match = next((l for l in self.config if l['pin'] == pin), None)
+        match = self.config.get(pin)
         if match is not None and match['config'] == self.IN:
-            if config == self.RISING or config == self.FALLING or config == BOTH:
-                mon = RepeatingTimer(0.1, target=self.check_event, args=pin, name="monitor_"+str(pin))
-                self.threads.append(mon)
-                mon.start()
-                self.events.append({'pin': pin, 'config': config, 'value': match['value'], 'callback': callback})
+            if config == self.RISING or config == self.FALLING or config == self.BOTH:
+                self.events[pin] = {'pin': pin, 'config': config, 'value': match['value'], 'callback': callback}
+                if self.callback_thread is None:
+                    # like RPi.GPIO, callbacks run one at a time on a dedicated thread
+                    self.callback_thread = threading.Thread(name='GPIOcallbacks', target=self.run_callbacks)
+                    self.callback_thread.setDaemon(True)
+                    self.callback_thread.start()
 
     def check_event(self, pin):
-        match_old = next((l for l in self.events if l['pin'] == pin), None)
+        match_old = self.events[pin]
         oldValue = match_old['value']
         condition = match_old['config']
         callback = match_old['callback']
-        match_new = next((l for l in self.config if l['pin'] == pin), None)
-        newValue = match_new['value']
+        newValue = self.config[pin]['value']
         if (condition == self.RISING and oldValue == self.LOW and newValue == self.HIGH) or \
                 (condition == self.FALLING and oldValue == self.HIGH and newValue == self.LOW) or \
                 (condition == self.BOTH and oldValue != newValue):
-            callback(self.getchannel(pin))
+            self.edges.put((callback, self.getchannel(pin)))
         match_old['value'] = newValue
 
-    # TODO: return an object that allows something to be modulated using start and stop functions
-    def PWM(self, pin, frequency):
-        print("PWM is an unsupported simulation function")
+    def run_callbacks(self):
+        while True:
+            edge = self.edges.get()
+            if edge is None:
+                break
+            callback, channel = edge
+            try:
+                callback(channel)
+            except Exception as e:
+                print('GPIO callback error: ' + str(e))
+
+    class PWMChannel(object):
+        """Simulated PWM output: the channel reads HIGH while started with a non-zero duty cycle"""
+
+        def __init__(self, gpio, channel, frequency):
+            self.gpio = gpio
+            self.channel = channel
+            self.frequency = frequency
+            self.dutycycle = 0
+            self.running = False
+
+        def _update(self):
+            self.gpio.output(self.channel, self.gpio.HIGH if self.running and self.dutycycle > 0 else self.gpio.LOW)
+
+        def start(self, dutycycle):
+            self.running = True
+            self.ChangeDutyCycle(dutycycle)
+
+        def ChangeFrequency(self, frequency):
+            self.frequency = frequency
+
+        def ChangeDutyCycle(self, dutycycle):
+            self.dutycycle = dutycycle
+            self._update()
+
+        def stop(self):
+            self.running = False
+            self._update()
+
+    def PWM(self, channel, frequency):
+        return self.PWMChannel(self, channel, frequency)
 
     def output(self, channel, state):
         pin = self.getpin(channel)
-        match = next((l for l in self.config if l['pin'] == pin), None)
-        if match is not None and match['config'] == self.OUT:
+        match = self.config.get(pin)
+        if match is not None and match['config'] == self.OUT and match['value'] != state:
             match['value'] = state
+            for listener in self.listeners:
+                listener(self.getchannel(pin), state)
+
+    def add_output_listener(self, listener):
+        """Registers listener(channel, state) to be called, on the writing thread, whenever an output changes"""
+        self.listeners.append(listener)
 
     def cleanup(self, channel=None):
-        for t in self.threads:
-            print("Cancelling " + t.name)
-            t.cancel()
+        if self.callback_thread is not None:
+            self.edges.put(None)
+            self.callback_thread = None
+        self.events = {}
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@
 import Tkinter as tk
 import threading
 import simGPIO
+import Queue
 from PIL import ImageTk, Image
 
 _debug = False
@@ -13,53 +14,6 @@ ON = 1
 OFF = 0
 
 
-class RepeatingTimer():
-    """ A Timer class that does not stop, unless you want it to.
-     Used to call repeating functions at defined intervals.
-    """
-
-    def __init__(self, seconds, target, args=None, name=''):
-        self._should_continue = False
-        self.is_running = False
-        self.seconds = seconds
-        self.target = target
-        self.args = args
-        self.thread = None
-        if name != '':
-            self.name = name
-
-    def _handle_target(self):
-        self.is_running = True
-        if self.args is not None:
-            self.target(self.args)
-        else:
-            self.target()
-        self.is_running = False
-        self._start_timer()
-
-    def _start_timer(self):
-        if self._should_continue:
-            self.thread = threading.Timer(self.seconds, self._handle_target)
-            # self.thread.setDaemon(True)
-            if self.name != '':
-                self.thread.name = self.name
-            self.thread.start()
-
-    def start(self):
-        if not self._should_continue and not self.is_running:
-            self._should_continue = True
-            self._start_timer()
-        else:
-            print('Timer already started or running, process must wait')
-
-    def cancel(self):
-        if self.thread is not None:
-            self._should_continue = False  # Just in case thread is running and cancel failed
-            self.thread.cancel()
-        else:
-            print('Timer never started or failed to initialize')
-
-
 class CircleButton(tk.Canvas):
     """A circular button widget that calls back on press and release conditions"""
 
@@ -120,7 +74,12 @@ class CircleIndicator(tk.Canvas):
 
 
 class FishDish(object):
-    """TODO: doc"""
+    """Simulated Fish Dish board whose indicators follow the simulated GPIO outputs.
+
+    Output changes are queued by the GPIO writer and applied in batches on the Tk thread.
+    """
+
+    refresh_ms = 10
 
     active_gpio = {
         "LED_GRN": 4,
@@ -131,19 +90,21 @@ class FishDish(object):
     }
 
     def __init__(self, GPIO, button_press_callback=None, button_release_callback=None):
-        self.threads = []
         self.GPIO = GPIO
         self.button_press_callback = button_press_callback
         self.button_release_callback = button_release_callback
         self.button_state = 0
-        self.root = tk.Tk()
-        self.root.withdraw()
-        self.GUI = self.Display(button_press_callback=self.button_press,
+        self.indicators = dict((channel, key) for key, channel in self.active_gpio.items() if key != "BUTTON")
+        self.changes = Queue.Queue()    # (indicator, state) to apply on the Tk thread, None to quit
+        # one Tk interpreter for the board and the GPIO pin display (see simGPIO.GPIO.display)
+        if GPIO.root is None:
+            GPIO.root = tk.Tk()
+            GPIO.root.withdraw()
+        self.root = GPIO.root
+        self.GUI = self.Display(changes=self.changes, refresh_ms=self.refresh_ms,
+                                button_press_callback=self.button_press,
                                 button_release_callback=self.button_release)
-        # self.threads.append(self.GUI)
-        self.monitor = RepeatingTimer(0.1, target=self.gpio_monitor, name="CheckGPIO")
-        self.threads.append(self.monitor)
-        self.monitor.start()
+        self.GPIO.add_output_listener(self.gpio_changed)
 
     class Display(threading.Thread):
         """A graphical display of the Fish Dish with widgets overlaid"""
@@ -151,10 +112,13 @@ class FishDish(object):
         buzzer_size = 50
         led_size = 20
 
-        def __init__(self, button_press_callback=None, button_release_callback=None):
+        def __init__(self, changes, refresh_ms, button_press_callback=None, button_release_callback=None):
             threading.Thread.__init__(self)
             self.name = "FishDishDisplay"
             self.setDaemon(True)
+            self.changes = changes
+            self.refresh_ms = refresh_ms
+            self.backlog = {}   # states still to draw by indicator, at most the next one and the newest
             if button_press_callback is not None:
                 self.button_press_callback = button_press_callback
             if button_release_callback is not None:
@@ -190,8 +154,36 @@ class FishDish(object):
         def run(self):
             self.window.protocol("WM_DELETE_WINDOW", self.quit_callback)
             self.window.title('Fish Dish')
+            self.window.after(self.refresh_ms, self.refresh)
             self.window.mainloop()
 
+        def refresh(self):
+            """Applies queued indicator changes on the Tk thread.
+
+            At most one change per indicator is drawn per refresh so that a short flash stays visible for a frame.
+            Changes faster than the refresh rate are collapsed to the next state and the newest one, so the
+            display never lags behind the GPIO by more than a frame.
+            """
+            try:
+                while True:
+                    change = self.changes.get_nowait()
+                    if change is None:
+                        self.window.quit()
+                        return
+                    indicator, indicator_state = change
+                    states = self.backlog.setdefault(indicator, [])
+                    if len(states) < 2:
+                        states.append(indicator_state)
+                    else:
+                        states[1] = indicator_state
+            except Queue.Empty:
+                pass
+            for indicator, states in self.backlog.items():
+                self.indicator_set(indicator, states.pop(0))
+                if not states:
+                    del self.backlog[indicator]
+            self.window.after(self.refresh_ms, self.refresh)
+
         def indicator_set(self, indicator, indicator_state):
             if indicator == "LED_GRN":
                 self.grnled.set_state(indicator_state)
@@ -204,44 +196,30 @@ class FishDish(object):
             else:
                 print("Undefined indicator.")
 
-    def gpio_monitor(self):
-        for key in self.active_gpio:
-            pinname = "GPIO" + str(self.active_gpio[key])
-            pin = self.GPIO.board_map[pinname]
-            match = next((l for l in self.GPIO.config if l['pin'] == pin), None)
-            if match is not None and match['config'] == self.GPIO.OUT and self.button_state != 1:
-                self.assert_led(key, match['value'])
+    def gpio_changed(self, channel, state):
+        indicator = self.indicators.get(channel)
+        if indicator is not None:
+            self.changes.put((indicator, state))
 
     def button_press(self):
         self.button_state = 1
-        pinname = "GPIO" + str(self.active_gpio["BUTTON"])
-        pin = self.GPIO.board_map[pinname]
-        match = next((l for l in self.GPIO.config if l['pin'] == pin), None)
-        if match is not None and match['config'] == self.GPIO.IN:
-            match['value'] = self.GPIO.HIGH
+        self.GPIO.set_input(self.active_gpio["BUTTON"], self.GPIO.HIGH)
         if _debug:
             print("Button pressed!")
-            self.assert_led(led_color='GRN', led_state=ON)
+            self.assert_led(led_color='LED_GRN', led_state=ON)
 
     def button_release(self):
         self.button_state = 0
-        pinname = "GPIO" + str(self.active_gpio["BUTTON"])
-        pin = self.GPIO.board_map[pinname]
-        match = next((l for l in self.GPIO.config if l['pin'] == pin), None)
-        if match is not None and match['config'] == self.GPIO.IN:
-            match['value'] = self.GPIO.LOW
+        self.GPIO.set_input(self.active_gpio["BUTTON"], self.GPIO.LOW)
         if _debug:
             print("Button released!")
-            self.assert_led(led_color='GRN', led_state=OFF)
+            self.assert_led(led_color='LED_GRN', led_state=OFF)
 
     def assert_led(self, led_color, led_state):
-        self.GUI.indicator_set(indicator=led_color, indicator_state=led_state)
+        self.changes.put((led_color, led_state))
 
     def cleanup(self):
-        self.GUI.quit_callback()
-        for t in self.threads:
-            print("Cancelling " + t.name)
-            t.cancel()
+        self.changes.put(None)
 
 
 if __name__ == "__main__":
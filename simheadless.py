@@ -0,0 +1,61 @@
+"""
+  Simulates the Fish Dish board without a GUI for Linux build machines
+  Follows the indicator states of the simulated GPIO and presses the button programmatically,
+  without importing Tkinter or PIL
+"""
+
+_debug = False
+
+ON = 1
+OFF = 0
+
+
+class FishDish(object):
+    """Headless Fish Dish with the same button and cleanup interface as simfishdish.FishDish"""
+
+    active_gpio = {
+        "LED_GRN": 4,
+        "LED_YEL": 22,
+        "LED_RED": 9,
+        "BUZZER": 8,
+        "BUTTON": 7
+    }
+
+    def __init__(self, GPIO):
+        self.threads = []
+        self.GPIO = GPIO
+        self.button_state = 0
+        self.indicators = dict((channel, key) for key, channel in self.active_gpio.items() if key != "BUTTON")
+        self.states = dict((key, OFF) for key in self.indicators.values())
+        self.GPIO.add_output_listener(self.gpio_changed)
+
+    def gpio_changed(self, channel, state):
+        indicator = self.indicators.get(channel)
+        if indicator is not None:
+            self.states[indicator] = state
+            if _debug:
+                print(indicator + ': ' + ('ON' if state == ON else 'OFF'))
+
+    def button_press(self):
+        self.button_state = 1
+        self.GPIO.set_input(self.active_gpio["BUTTON"], self.GPIO.HIGH)
+        if _debug:
+            print("Button pressed!")
+
+    def button_release(self):
+        self.button_state = 0
+        self.GPIO.set_input(self.active_gpio["BUTTON"], self.GPIO.LOW)
+        if _debug:
+            print("Button released!")
+
+    def hold_button(self, seconds, delay=0.0):
+        """Presses the button after delay seconds and releases it after holding for seconds"""
+        import eventloop
+        timers = eventloop.shared_loop()
+        self.threads.append(timers.call_later(delay, self.button_press, name='button_press'))
+        self.threads.append(timers.call_later(delay + seconds, self.button_release, name='button_release'))
+
+    def cleanup(self):
+        for t in self.threads:
+            t.cancel()
+        self.threads = []
@@ -0,0 +1,112 @@
+"""
+    Compiled song cache
+    Stores a parsed RTTL song as a compact binary file of tempo, MIDI note numbers and durations
+    so that songs are parsed only once and loaded with memory-mapped reads afterwards
+
+    File layout (little endian):
+        header: magic, SHA-1 digest of the RTTL source, tempo, note count, title length
+        title (utf-8), notes (uint8 MIDI numbers, 0 for a pause), durations (uint16 divisors)
+"""
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+
+MAGIC = b'FDS2'
+EXTENSION = '.rttc'
+
+_header = struct.Struct('<4s20sHHH')
+
+
+def digest(source):
+    """Returns the SHA-1 content hash of an RTTL source string"""
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).digest()
+
+
+def cachepath(path):
+    """Returns the cache file stored next to an RTTL source file"""
+    return os.path.splitext(path)[0] + EXTENSION
+
+
+def store(path, key, title, tempo, notes, durations):
+    """Writes a compiled song to path, replacing any previous cache (atomically except on Windows).
+
+    :param path: cache file name
+    :param key: content hash of the RTTL source (see digest)
+    :param title: song title
+    :param tempo: beats per minute
+    :param notes: MIDI note numbers (0 for a pause)
+    :param durations: note duration divisors
+    :raises ValueError: if a value does not fit the file layout
+    """
+    try:
+        midi = array('B', notes)
+        durs = array('H', durations)
+    except OverflowError:
+        raise ValueError('note number or duration out of range for the song cache')
+    name = title.encode('utf-8')
+    if not 0 <= tempo <= 0xFFFF or len(midi) > 0xFFFF or len(name) > 0xFFFF:
+        raise ValueError('tempo, note count or title length out of range for the song cache')
+    if sys.byteorder != 'little':
+        durs.byteswap()
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(_header.pack(MAGIC, key, tempo, len(midi), len(name)))
+            f.write(name)
+            f.write(midi.tostring())
+            f.write(durs.tostring())
+        if sys.platform.lower().startswith('win32') and os.path.exists(path):
+            os.remove(path)     # Python 2 cannot rename over an existing file on Windows
+        os.rename(tmp, path)
+    except (IOError, OSError, struct.error):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load(path, key):
+    """Reads a compiled song if it exists and matches the source hash.
+
+    :param path: cache file name
+    :param key: content hash of the current RTTL source
+    :return: (title, tempo, notes, durations) or None if missing or stale
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    with f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return None     # empty or unmappable file
+        try:
+            if len(buf) < _header.size:
+                return None
+            magic, cached_key, tempo, count, name_len = _header.unpack_from(buf, 0)
+            if magic != MAGIC or cached_key != key:
+                return None
+            pos = _header.size
+            end = pos + name_len + 3 * count
+            if len(buf) != end:
+                return None
+            title = buf[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            midi = array('B')
+            midi.fromstring(buf[pos:pos + count])
+            pos += count
+            durs = array('H')
+            durs.fromstring(buf[pos:end])
+        finally:
+            buf.close()
+    if sys.byteorder != 'little':
+        durs.byteswap()
+    return title, tempo, midi, durs
@@ -0,0 +1,68 @@
+"""
+    Control socket of a running fishdish
+    Starts fishdish.py headless with a control socket and checks that commands a client could use to flood the
+    event loop are refused while the daemon keeps answering.
+
+    usage: python -m unittest test_control (Unix only)
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import unittest
+import subprocess
+
+import control
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fishdish.py')
+START = 10.0        # seconds allowed for the control socket to appear
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs Unix domain sockets')
+class ControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()     # the log file is written to the working directory
+        self.path = os.path.join(self.directory, 'fishdish.sock')
+        env = dict(os.environ, FISHDISH_HEADLESS='1')
+        self.process = subprocess.Popen([sys.executable, SCRIPT, '--control', self.path], cwd=self.directory,
+                                        env=env, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        deadline = time.time() + START
+        while not os.path.exists(self.path) and time.time() < deadline:
+            self.assertIsNone(self.process.poll(), 'fishdish exited during start-up')
+            time.sleep(0.05)
+        self.assertTrue(os.path.exists(self.path), 'no control socket after ' + str(START) + 's')
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            deadline = time.time() + 5.0
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.directory)
+
+    def send(self, command):
+        return control.send(command, self.path, timeout=2.0)
+
+    def test_tiny_period_refused(self):
+        for command in ('led breathe red 1e-9', 'led blink grn 1e-7 0', 'led heartbeat yel 0.001'):
+            self.assertTrue(self.send(command).startswith('error period'), command)
+        self.assertEqual(self.send('ping'), 'ok pong')
+        self.assertTrue(self.send('status').startswith('ok {'))
+
+    def test_pattern_still_answers(self):
+        self.assertEqual(self.send('led breathe red 0.05'), 'ok')
+        for _ in range(10):
+            self.assertEqual(self.send('ping'), 'ok pong')
+        self.assertEqual(self.send('led stop red'), 'ok')
+
+
+if __name__ == "__main__":
+    unittest.main()
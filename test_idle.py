@@ -0,0 +1,70 @@
+"""
+    Idle CPU budget of a running fishdish
+    Starts fishdish.py headless, waits for the start-up song and flashes to finish, then measures the CPU time
+    the process uses over an idle window from /proc/<pid>/stat and stops it with SIGTERM.
+
+    usage: python -m unittest test_idle (Linux only)
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import unittest
+import subprocess
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fishdish.py')
+SETTLE = 6.0        # seconds for the start-up song and green flashes
+WINDOW = 3.0        # idle seconds measured
+BUDGET = 0.03       # share of one core allowed while idle
+
+
+def cpu_time(pid):
+    """Returns the user and system CPU seconds used by a process"""
+    with open('/proc/' + str(pid) + '/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/stat'), 'needs /proc')
+class IdleCPUTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()     # the log file is written to the working directory
+        self.process = None
+
+    def tearDown(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.directory)
+
+    def idle_share(self, *options):
+        env = dict(os.environ, FISHDISH_HEADLESS='1')
+        self.process = subprocess.Popen([sys.executable, SCRIPT] + list(options), cwd=self.directory, env=env,
+                                        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        time.sleep(SETTLE)
+        self.assertIsNone(self.process.poll(), 'fishdish exited during start-up')
+        start, used = time.time(), cpu_time(self.process.pid)
+        time.sleep(WINDOW)
+        share = (cpu_time(self.process.pid) - used) / (time.time() - start)
+        self.process.send_signal(signal.SIGTERM)
+        deadline = time.time() + 5.0
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertIsNotNone(self.process.poll(), 'fishdish did not stop on SIGTERM')
+        return share
+
+    def test_threads(self):
+        share = self.idle_share()
+        self.assertLess(share, BUDGET, 'idle CPU ' + str(round(share * 100, 1)) + '% of a core')
+
+    def test_eventloop(self):
+        share = self.idle_share('--eventloop')
+        self.assertLess(share, BUDGET, 'idle CPU ' + str(round(share * 100, 1)) + '% of a core')
+
+
+if __name__ == "__main__":
+    unittest.main()
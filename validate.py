@@ -0,0 +1,174 @@
+"""
+    Parallel RTTL corpus validator
+    Parses every .rttl file under the given directories in a process pool, rejecting malformed ringtones and
+    notes missing from the tone table, and reports the duration and pitch range of each ringtone as JSON.
+
+    usage: fishdish.py validate [--jobs N] [--min-pitch HZ] [--max-pitch HZ] [--max-duration SECONDS]
+                                [--output FILE] PATH [PATH ...]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import rttl
+
+EXTENSION = '.rttl'
+
+_tones = None       # Hz by note name, set in every worker
+_limits = None
+
+
+def _init(tones, limits):
+    global _tones
+    global _limits
+    _tones = tones
+    _limits = limits
+
+
+def check(title, tempo, notes):
+    """Checks one parsed ringtone against the tone table and limits.
+
+    :param notes: iterable of (note, duration divisor)
+    :return: dictionary of title, tempo, note count, playing time, pitch range, errors and warnings
+    """
+    min_pitch, max_pitch, max_duration = _limits
+    errors = []
+    warnings = []
+    beat = 108.0 / float(tempo) if tempo > 0 else 0.0
+    if tempo <= 0:
+        errors.append('tempo ' + str(tempo) + ' is not positive')
+    count = 0
+    seconds = 0.0
+    lowest = None
+    highest = None
+    for note, divisor in notes:
+        if divisor <= 0:
+            errors.append('note ' + str(count) + ': duration 1/' + str(divisor) + ' is not positive')
+        else:
+            seconds += beat / divisor * 1.3     # including the articulation gap, as played by Song.playsong
+        pitch = _tones.get(note)
+        if pitch is None:
+            errors.append('note ' + str(count) + ': unknown note ' + note)
+        elif pitch > 0:
+            if lowest is None or pitch < lowest:
+                lowest = pitch
+            if highest is None or pitch > highest:
+                highest = pitch
+        count += 1
+    if count == 0:
+        errors.append('no notes')
+    if lowest is not None and lowest < min_pitch:
+        warnings.append('lowest pitch ' + str(lowest) + 'Hz is below ' + str(min_pitch) + 'Hz')
+    if highest is not None and highest > max_pitch:
+        warnings.append('highest pitch ' + str(highest) + 'Hz is above ' + str(max_pitch) + 'Hz')
+    if max_duration and seconds > max_duration:
+        warnings.append('plays for ' + str(round(seconds, 1)) + 's, longer than ' + str(max_duration) + 's')
+    return {
+        'title': title,
+        'tempo': tempo,
+        'notes': count,
+        'duration': round(seconds, 3),
+        'min_pitch': lowest,
+        'max_pitch': highest,
+        'valid': not errors,
+        'errors': errors,
+        'warnings': warnings,
+    }
+
+
+def validate_file(path):
+    """Validates every ringtone in a RTTL file (runs in a worker process).
+
+    :return: list of check() results with the path, or one invalid result if the file cannot be parsed
+    """
+    results = []
+    try:
+        with open(path) as f:
+            for title, tempo, notes in rttl.stream(f):
+                result = check(title, tempo, notes)
+                result['path'] = path
+                results.append(result)
+        if not results:
+            raise rttl.RTTLError('No ringtone', '', 0)
+    except (rttl.RTTLError, IOError, ValueError) as e:
+        results.append({'path': path, 'title': None, 'valid': False, 'errors': [str(e)], 'warnings': []})
+    return results
+
+
+def find(paths):
+    """Returns the RTTL files among paths and in the directory trees under them, sorted"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files.extend(os.path.join(directory, name) for name in names if name.lower().endswith(EXTENSION))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def run(paths, tones, jobs=None, min_pitch=100, max_pitch=8000, max_duration=None):
+    """Validates a corpus in a pool of jobs processes (default one per core).
+
+    :param tones: pitch in Hz by note name, e.g. fishdish.Song.tones
+    :return: the report as a dictionary
+    """
+    start = time.time()
+    files = find(paths)
+    jobs = jobs or multiprocessing.cpu_count()
+    limits = (min_pitch, max_pitch, max_duration)
+    if jobs == 1:
+        _init(tones, limits)
+        batches = [validate_file(path) for path in files]
+    else:
+        pool = multiprocessing.Pool(jobs, _init, (tones, limits))
+        try:
+            # several files per task keeps the inter-process overhead small on large corpora of short files
+            chunksize = max(1, len(files) // (jobs * 8))
+            batches = list(pool.imap_unordered(validate_file, files, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    results = sorted((result for batch in batches for result in batch), key=lambda result: result['path'])
+    invalid = sum(1 for result in results if not result['valid'])
+    return {
+        'files': len(files),
+        'ringtones': len(results),
+        'valid': len(results) - invalid,
+        'invalid': invalid,
+        'warnings': sum(1 for result in results if result['warnings']),
+        'jobs': jobs,
+        'elapsed': round(time.time() - start, 3),
+        'results': results,
+    }
+
+
+def main(argv, tones):
+    """Command line entry point, see the module usage.
+
+    :return: exit status, 1 if any ringtone is invalid
+    """
+    parser = argparse.ArgumentParser(prog='fishdish.py validate', description='Validate RTTL ringtone files')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='RTTL file or directory tree')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default one per core)')
+    parser.add_argument('--min-pitch', type=int, default=100, metavar='HZ',
+                        help='warn about notes below this pitch (default 100)')
+    parser.add_argument('--max-pitch', type=int, default=8000, metavar='HZ',
+                        help='warn about notes above this pitch (default 8000)')
+    parser.add_argument('--max-duration', type=float, default=None, metavar='SECONDS',
+                        help='warn about ringtones that play for longer')
+    parser.add_argument('-o', '--output', help='write the JSON report to a file instead of stdout')
+    args = parser.parse_args(argv)
+    report = run(args.paths, tones, args.jobs, args.min_pitch, args.max_pitch, args.max_duration)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        sys.stderr.write(str(report['valid']) + ' of ' + str(report['ringtones']) + ' ringtones valid in ' +
+                         str(report['elapsed']) + 's\n')
+    else:
+        print(text)
+    return 1 if report['invalid'] else 0